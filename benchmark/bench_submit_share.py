@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+'''Benchmark of share validation.
+
+Builds block templates from recorded getblocktemplate result and drives
+TemplateRegistry.submit_share with synthetic (or replayed) share corpus
+for every proof-of-work algorithm. Reports shares/sec, latency percentiles
+and accept/reject mix, so regressions can be caught before deploying.
+
+Run me from the root of the repository (config.py is used like by the pool).
+No database, memcache or Stratum framework is needed, mining.interfaces
+is replaced by a stub before lib/ modules are imported:
+
+    python benchmark/bench_submit_share.py
+    python benchmark/bench_submit_share.py --algo scrypt --shares 50000 --processes 4
+    python benchmark/bench_submit_share.py --save-corpus corpus.json
+    python benchmark/bench_submit_share.py --corpus corpus.json
+'''
+
+import os, sys
+sys.path = [os.getcwd(), os.path.join(os.getcwd(), 'conf'),
+            os.path.join(os.getcwd(), 'externals', 'stratum-mining-proxy'),] + sys.path
+
+import time
+import json
+import copy
+import types
+import random
+import argparse
+import binascii
+from twisted.internet import reactor, defer
+
+class Interfaces(object):
+    '''Stands in for mining.interfaces, which connects
+    to MySQL and memcache when it's imported'''
+    timestamper = None
+    template_registry = None
+
+class BenchTimestamper(object):
+    '''Predictable time around the recorded template'''
+    start_time = 1345678900
+    delta = 0
+
+    def time(self):
+        self.delta += 1
+        return self.start_time + self.delta
+
+sys.modules['mining'] = types.ModuleType('mining')
+sys.modules['mining.interfaces'] = types.ModuleType('mining.interfaces')
+sys.modules['mining.interfaces'].Interfaces = Interfaces
+
+import lib.settings as settings
+from lib import algorithms
+from lib.block_template import BlockTemplate
+from lib.template_registry import TemplateRegistry
+from lib.exceptions import SubmitException
+from lib.share_verifier import start_pool, stop_pool
+from lib.tx_cache import TransactionCache
+
+ALGORITHMS = ['sha256d', 'scrypt', 'quark', 'skeinhash']
+DEFAULT_TEMPLATE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'getblocktemplate.json')
+
+class BenchCoinbaser(object):
+    '''Coinbaser paying to constant pubkey hash, no wallet needed'''
+    def get_script_pubkey(self):
+        return '\x76\xa9\x14' + '\x11' * 20 + '\x88\xac'
+
+    def get_coinbase_data(self):
+        return ''
+
+class BenchBitcoinRPC(object):
+    '''Serves recorded getblocktemplate result'''
+    def __init__(self, template):
+        self.template = template
+
+    def getblocktemplate(self):
+        return defer.succeed(copy.deepcopy(self.template))
+
+    def submitblock(self, block, hash_hex, scrypt_hex):
+        return defer.succeed((True, hash_hex))
+
+def build_registry(algo, template, processes):
+    settings.SHARE_VERIFIER_PROCESSES = processes
+    template_class = type('BenchBlockTemplate', (BlockTemplate,), {'algo': algo})
+    return TemplateRegistry(template_class, BenchCoinbaser(), BenchBitcoinRPC(template), 0,
+                            lambda is_new_block: None, lambda prevhash, height: None)
+
+def build_corpus(template, extranonce2_size, count, difficulty, seed):
+    '''Synthetic mix of shares. job_id None means the current job,
+    difficulty None the default difficulty of the algorithm.'''
+    rnd = random.Random(seed)
+    ntime = "%08x" % template['curtime']
+    connections = [ "%08x" % rnd.getrandbits(32) for _ in range(256) ]
+
+    corpus = []
+    for _ in xrange(count):
+        r = rnd.random()
+        if r < 0.02 and corpus:
+            corpus.append(dict(rnd.choice(corpus)))
+            continue
+
+        share = {'extranonce1': rnd.choice(connections),
+                 'job_id': None,
+                 'extranonce2': "%0*x" % (extranonce2_size * 2, rnd.getrandbits(extranonce2_size * 8)),
+                 'ntime': ntime,
+                 'nonce': "%08x" % rnd.getrandbits(32),
+                 'difficulty': difficulty}
+        if r < 0.03:
+            share['job_id'] = 'stale'
+        elif r < 0.04:
+            share['ntime'] = "%08x" % (template['curtime'] - 600)
+        corpus.append(share)
+    return corpus
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def bench_template_build(template, builds):
+    '''Time of building template from getblocktemplate result with the transaction
+    cache warm (next refresh of the same mempool) and cold (all transactions decoded)'''
+    shared_cache = BlockTemplate.tx_cache
+    try:
+        for cold in (False, True):
+            elapsed = 0.0
+            for i in xrange(builds):
+                data = copy.deepcopy(template)
+                if cold:
+                    BlockTemplate.tx_cache = TransactionCache(settings.TX_CACHE_GENERATIONS)
+                block = BlockTemplate(Interfaces.timestamper, BenchCoinbaser(), "%x" % i)
+                start = time.time()
+                block.fill_from_rpc(data)
+                elapsed += time.time() - start
+            print "%-10s %7d builds %10.3f ms/template (%s transaction cache)" % \
+                  ('template', builds, elapsed / builds * 1000, 'cold' if cold else 'warm')
+    finally:
+        BlockTemplate.tx_cache = shared_cache
+
+def default_difficulty(registry):
+    '''Difficulty accepting about quarter of random shares, so both
+    accept and reject paths are measured whatever diff1 the algorithm has'''
+    return registry.diff1 / float(2 ** 254)
+
+@defer.inlineCallbacks
+def bench(algo, template, corpus, processes, concurrency):
+    registry = build_registry(algo, template, processes)
+    job_id = registry.last_block.job_id
+    difficulty = default_difficulty(registry)
+    sessions = {}
+    latencies = []
+    results = {}
+
+    def _done(result, start):
+        latencies.append(time.time() - start)
+        results['accepted'] = results.get('accepted', 0) + 1
+
+    def _failed(failure, start):
+        latencies.append(time.time() - start)
+        failure.trap(SubmitException)
+        reason = str(failure.value.args[0]) if failure.value.args else 'unknown'
+        results[reason] = results.get(reason, 0) + 1
+
+    def _submit(share):
+        start = time.time()
+        session = sessions.setdefault(share['extranonce1'], {})
+        try:
+            d = registry.submit_share(share['job_id'] or job_id, 'bench.worker', session,
+                                      binascii.unhexlify(share['extranonce1']), share['extranonce2'],
+                                      share['ntime'], share['nonce'], share['difficulty'] or difficulty)
+        except SubmitException as e:
+            d = defer.fail(e)
+        d.addCallbacks(_done, _failed, callbackArgs=(start,), errbackArgs=(start,))
+        return d
+
+    start = time.time()
+    for i in xrange(0, len(corpus), concurrency):
+        yield defer.DeferredList([ _submit(share) for share in corpus[i:i + concurrency] ])
+    elapsed = time.time() - start
+
+    latencies.sort()
+    print "%-10s %7d shares %10.1f shares/sec   p50 %.3f ms   p99 %.3f ms" % \
+          (algo.name, len(corpus), len(corpus) / elapsed, percentile(latencies, 0.50) * 1000,
+           percentile(latencies, 0.99) * 1000)
+    for (reason, cnt) in sorted(results.items(), key=lambda x: -x[1]):
+        print "           %6.2f%% %s" % (100.0 * cnt / len(corpus), reason)
+
+@defer.inlineCallbacks
+def main(args):
+    Interfaces.timestamper = BenchTimestamper()
+    template = json.load(open(args.template))
+
+    if args.corpus:
+        corpus = json.load(open(args.corpus))
+    else:
+        extranonce2_size = BlockTemplate.coinbase_transaction_class.extranonce_size - 4
+        corpus = build_corpus(template, extranonce2_size, args.shares, args.difficulty, args.seed)
+    if args.save_corpus:
+        json.dump(corpus, open(args.save_corpus, 'w'))
+
+    print "Template: %d transactions, corpus: %d shares" % (len(template['transactions']), len(corpus))
+    if args.template_builds:
+        bench_template_build(template, args.template_builds)
+    for name in (args.algo or ALGORITHMS):
+        try:
+            algo = algorithms.get_algorithm(name)
+        except ImportError as e:
+            print "%-10s skipped (%s)" % (name, e)
+            continue
+
+        try:
+            yield bench(algo, template, corpus, args.processes, args.concurrency)
+        except Exception as e:
+            print "%-10s failed: %s" % (name, e)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of TemplateRegistry.submit_share')
+    parser.add_argument('--algo', action='append', choices=sorted(algorithms.algorithms.keys()),
+                        help='algorithm to benchmark, may be repeated (default: %s)' % ', '.join(ALGORITHMS))
+    parser.add_argument('--template', default=DEFAULT_TEMPLATE, help='recorded getblocktemplate result')
+    parser.add_argument('--shares', type=int, default=20000, help='size of synthetic corpus')
+    parser.add_argument('--difficulty', type=float, default=None,
+                        help='share difficulty (default: accepts about 25%% of shares for every algorithm)')
+    parser.add_argument('--seed', type=int, default=1, help='seed of synthetic corpus')
+    parser.add_argument('--corpus', help='replay share corpus from JSON file')
+    parser.add_argument('--save-corpus', help='save share corpus to JSON file')
+    parser.add_argument('--template-builds', type=int, default=20,
+                        help='templates built to measure transaction cache (0 = skip)')
+    parser.add_argument('--processes', type=int, default=0, help='share verifier processes')
+    parser.add_argument('--concurrency', type=int, default=100, help='shares submitted at once')
+    args = parser.parse_args()
+
+    def _run():
+        d = main(args)
+        d.addErrback(lambda f: f.printTraceback())
+        d.addBoth(lambda _: stop_pool())
+        d.addBoth(lambda _: reactor.stop())
+
+    # Verification processes are forked before the reactor starts
+    start_pool(args.processes)
+    reactor.callWhenRunning(_run)
+    reactor.run()
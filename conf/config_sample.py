@@ -24,6 +24,11 @@ COINDAEMON_TRUSTED_PASSWORD = 'somepassword'
 # If the option does not meet either of these criteria stratum defaults to scrypt
 # For Coins which support TX Messages please enter yes in the TX selection
 COINDAEMON_ALGO = 'scrypt'
+# Share difficulty 1 is the scrypt one for all algorithms by default. With True
+# the algorithm's own difficulty 1 is used: share difficulty gets 65536x higher
+# for sha256d and skeinhash and 256x for quark. UPGRADE NOTE: adjust POOL_TARGET,
+# VDIFF settings and payouts based on share difficulty before enabling it.
+COINDAEMON_ALGO_DIFF1 = False
 COINDAEMON_TX = 'no'
 
 
@@ -132,6 +137,13 @@ DB_USERCACHE_TIME = 600         # How long the usercache is good for before we r
 USERS_AUTOADD = False           # Automatically add users to database when they connect.
                                 # This basically disables User Auth for the pool.
 USERS_CHECK_PASSWORD = False    # Check the workers password? (Many pools don't)
+AUTH_CACHE_SIZE = 100000        # Workers kept in the in-process authorization cache
+AUTH_CACHE_TIME = 300           # Successful authorization is trusted for this many seconds without memcache lookup
+AUTH_CACHE_NEGATIVE_TIME = 30   # Failed authorization is remembered for this many seconds
+                                #   (use admin call mining.invalidate_worker after changing a password)
+WORKER_PRELOAD = False          # Load usernames and passwords of all workers into memory on startup,
+                                #   so reconnecting miners don't query the database one by one
+WORKER_PRELOAD_REFRESH = 60     # Reload whole pool_worker table every this many seconds (new, changed and removed workers)
 
 # Transaction Settings
 COINBASE_EXTRAS = '/stratumPool/'           # Extra Descriptive String to incorporate in solved blocks
@@ -188,6 +200,49 @@ ENABLE_WORKER_BANNING = True    # Enable/disable temporary worker banning
 WORKER_CACHE_TIME = 600         # How long the worker stats cache is good before we check and refresh
 WORKER_BAN_TIME = 300           # How long we temporarily ban worker
 INVALID_SHARES_PERCENT = 50     # Allow average invalid shares vary this % before we ban
+WORKER_BAN_IP = False           # Ban also IP address of the banned worker
+# Bans (by invalid shares, WORKER_BAN_IP and admin ban_ip) are kept in a single ban table
+# with expiry time. Shares of banned workers are rejected before hashing and recorded
+# as invalid. Rate limited submits and shares from banned IPs aren't recorded.
+# With FRONTEND_PROCESSES, IP bans are passed to all processes, worker bans are per process.
+
+# Submit rate limit of one connection, eg. 50 (disabled by default)
+SUBMIT_RATE_LIMIT = 0           # Max submits per second of one connection on average, 0 disables the limit
+                                #   (keep it high if miners connect through a stratum proxy)
+SUBMIT_RATE_BURST = 100         # Max submits one connection can send at once
+
+# ******************** Share Verification Settings *********************
+SHARE_VERIFIER_PROCESSES = 0    # Number of worker processes calculating proof-of-work of shares.
+                                #   0 calculates hashes in the main process. Set to the number of cores
+                                #   you can spare to scale share throughput with the core count.
+SHARE_VERIFIER_MAX_QUEUE = 10000    # Reject shares when this many are waiting for verification (0 = unlimited)
+SHARE_VERIFIER_BATCH_SIZE = 16  # Max shares hashed by worker process in one batch
+SHARE_VERIFIER_TIMEOUT = 30     # Fail shares of the batch not verified in this many seconds (worker process died)
+
+# Duplicate share detection
+DUPLICATE_FILTER_MAX_ENTRIES = 100000   # Shares remembered exactly per job, then the filter switches to bloom filter
+DUPLICATE_FILTER_BLOOM = False          # Use probabilistic bloom filter from the beginning (less memory,
+                                        #   but valid share may be rarely rejected as duplicate)
+DUPLICATE_FILTER_ERROR_RATE = 0.0001    # False positive rate of the bloom filter
+
+TARGET_CACHE_SIZE = 64          # How many difficulty to target conversions are memoized
+TX_CACHE_GENERATIONS = 2        # Transactions unused by this many last templates are evicted from the cache
+BLOCK_TAIL_HEX = False          # Keep also hex form of template transactions, saves hexlify of whole block on submit
+EMPTY_TEMPLATE_ON_NEW_BLOCK = False     # Broadcast coinbase-only template as soon as new block notification
+                                        #   arrives. Needs coin daemon with getbestblockhash and getblock.
+EMPTY_TEMPLATE_HALVING_INTERVAL = 0     # Subsidy halving interval of the coin (210000 bitcoin, 840000 litecoin),
+                                        #   required by empty templates. Not for coins with other subsidy schedule.
+TEMPLATE_HISTORY_MAX_JOBS = 0   # Jobs of the current block kept for late shares (0 = unlimited)
+TEMPLATE_HISTORY_MAX_AGE = 0    # Drop jobs of the current block older than this many seconds (0 = unlimited)
+                                #   Miners keep working on old jobs of the block until clean_jobs, so when bounding
+                                #   the history prefer the age (several MERKLE_REFRESH_INTERVALs) over job count.
+BROADCAST_CHUNK_SIZE = 500      # Connections notified about new job per reactor iteration (0 = all at once)
+
+# ******************** Multi-process Settings *********************
+FRONTEND_PROCESSES = 0          # Extra front-end processes sharing the Stratum port (SO_REUSEPORT), 0 = single process
+                                #   (can't be used with COINSWITCHING, the pool refuses to start)
+FRONTEND_SOCKET = '/tmp/stratum-mining/distributor.sock'   # UNIX socket used to push templates to the front-ends,
+                                # absolute path, its directory is created private to the pool user (mode 0700)
 
 # ******************** E-Mail Notification Settings *********************
 NOTIFY_EMAIL_TO = ''                                            # Where to send Start/Found block notifications
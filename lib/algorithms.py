@@ -0,0 +1,108 @@
+'''Registry of supported proof-of-work algorithms.
+
+Algorithm is resolved once on startup (see get_algorithm) and bound
+to the block template and the template registry, so hot paths don't
+compare settings.COINDAEMON_ALGO on every share. New algorithm is
+added by registering function which imports its hashing module
+and returns PowAlgorithm instance.'''
+
+import struct
+import util
+
+import lib.logger
+log = lib.logger.get_logger('algorithms')
+
+# Padding of 80-byte header to a full hashed block, stored in shares table
+SCRYPT_HEADER_SUFFIX = "000000800000000000000000000000000000000000000000000000000000000000000000000000000000000080020000"
+
+# Target of difficulty 1 share of scrypt, pool used it for all algorithms
+# before (see COINDAEMON_ALGO_DIFF1)
+SCRYPT_DIFF1 = 0x0000ffff00000000000000000000000000000000000000000000000000000000
+
+class PowAlgorithm(object):
+    '''Proof-of-work algorithm of the coin.
+
+        - name - value of COINDAEMON_ALGO
+        - hash - function calculating hash of 80-byte block header (in block byte order)
+        - diff1 - target of difficulty 1 share
+        - header_suffix - hex padding appended to block header in shares table
+        - batch_hash - optional function hashing list of headers at once
+    '''
+
+    def __init__(self, name, hash, diff1, header_suffix='', batch_hash=None):
+        self.name = name
+        self.hash = hash
+        self.diff1 = diff1
+        self.header_suffix = header_suffix
+        self.batch_hash = batch_hash
+
+    def hash_batch(self, headers):
+        '''Returns list of hashes of given headers'''
+        if self.batch_hash != None:
+            return self.batch_hash(headers)
+        return [ self.hash(h) for h in headers ]
+
+    def __repr__(self):
+        return "PowAlgorithm(%s)" % self.name
+
+def _scrypt():
+    import ltc_scrypt
+    return PowAlgorithm('scrypt', ltc_scrypt.getPoWHash, SCRYPT_DIFF1, SCRYPT_HEADER_SUFFIX)
+
+def _scrypt_jane():
+    import yac_scrypt
+
+    def pow_hash(header):
+        # N-factor of scrypt-jane depends on ntime, which is stored in the header
+        return yac_scrypt.getPoWHash(header, struct.unpack("<I", header[68:72])[0])
+
+    return PowAlgorithm('scrypt-jane', pow_hash, SCRYPT_DIFF1, SCRYPT_HEADER_SUFFIX)
+
+def _quark():
+    import quark_hash
+    return PowAlgorithm('quark', quark_hash.getPoWHash,
+                        0x000000ffff000000000000000000000000000000000000000000000000000000,
+                        SCRYPT_HEADER_SUFFIX)
+
+def _skeinhash():
+    import skeinhash
+    return PowAlgorithm('skeinhash', skeinhash.skeinhash,
+                        0x00000000ffff0000000000000000000000000000000000000000000000000000)
+
+def _sha256d():
+    return PowAlgorithm('sha256d', util.doublesha,
+                        0x00000000ffff0000000000000000000000000000000000000000000000000000)
+
+algorithms = {
+    'scrypt': _scrypt,
+    'scrypt-jane': _scrypt_jane,
+    'quark': _quark,
+    'skeinhash': _skeinhash,
+    'sha256d': _sha256d,
+}
+
+_resolved = {}
+
+def register(name, factory):
+    '''Registers new algorithm. factory is called without
+    arguments and has to return PowAlgorithm instance.'''
+    algorithms[name] = factory
+    _resolved.pop(name, None)
+
+def get_algorithm(name):
+    '''Returns PowAlgorithm for given COINDAEMON_ALGO value.
+    Unknown algorithms fall back to sha256d.'''
+    try:
+        return _resolved[name]
+    except KeyError:
+        pass
+
+    if name in algorithms:
+        algo = algorithms[name]()
+    else:
+        log.warning("Unknown algorithm '%s', using sha256d" % name)
+        algo = _sha256d()
+
+    log.debug("Loaded %s proof-of-work" % algo.name)
+    _resolved[name] = algo
+    return algo
@@ -11,6 +11,20 @@ import time
 import lib.logger
 log = lib.logger.get_logger('bitcoin_rpc')
 
+# Stands for the hex form of submitted block in request params
+BLOCK_PLACEHOLDER = '%%block%%'
+
+# JSON-RPC error code of unknown method
+METHOD_NOT_FOUND = -32601
+
+def is_method_not_found(error):
+    '''True if the error is response of coin daemon
+    which doesn't know the called method'''
+    try:
+        return json.loads(error[2])['error']['code'] == METHOD_NOT_FOUND
+    except Exception:
+        return False
+
 class BitcoinRPC(object):
     
     def __init__(self, host, port, username, password):
@@ -41,6 +55,22 @@ class BitcoinRPC(object):
                 'id': '1',
             }))
     
+    def _encode_block_request(self, method, params, block):
+        '''Encode JSON-RPC request, BLOCK_PLACEHOLDER in params is replaced
+        by hex form of the block. Hex chunks are joined directly into
+        the request body, so the block is not copied by json.dumps.'''
+        (prefix, suffix) = json.dumps({
+                'jsonrpc': '2.0',
+                'method': method,
+                'params': params,
+                'id': '1',
+            }).split(json.dumps(BLOCK_PLACEHOLDER))
+        
+        chunks = [ prefix, '"' ]
+        chunks.extend(block.hex_chunks())
+        chunks.extend([ '"', suffix ])
+        return ''.join(chunks)
+    
     @defer.inlineCallbacks
     def check_submitblock(self):
         try:
@@ -63,7 +93,20 @@ class BitcoinRPC(object):
             defer.returnValue(self.has_submitblock)
 
     @defer.inlineCallbacks
-    def submitblock(self, block_hex, hash_hex, scrypt_hex):
+    def submitblock(self, block, hash_hex, scrypt_hex):
+        '''block is SerializedBlock'''
+        # Request bodies are encoded once, on the first attempt which needs them
+        requests = {}
+        def submitblock_request():
+            if 'submitblock' not in requests:
+                requests['submitblock'] = self._encode_block_request('submitblock', [BLOCK_PLACEHOLDER,], block)
+            return requests['submitblock']
+        def getblocktemplate_request():
+            if 'getblocktemplate' not in requests:
+                requests['getblocktemplate'] = self._encode_block_request('getblocktemplate',
+                                                        [{'mode': 'submit', 'data': BLOCK_PLACEHOLDER}], block)
+            return requests['getblocktemplate']
+        
     #try 5 times? 500 Internal Server Error could mean random error or that TX messages setting is wrong
         attempts = 0
         while True:
@@ -71,8 +114,7 @@ class BitcoinRPC(object):
             if self.has_submitblock == True:
                 try:
                     log.debug("Submitting Block with submitblock: attempt #"+str(attempts))
-                    log.debug([block_hex,])
-                    resp = (yield self._call('submitblock', [block_hex,]))
+                    resp = (yield self._call_raw(submitblock_request()))
                     log.debug("SUBMITBLOCK RESULT: %s", resp)
                     break
                 except Exception as e:
@@ -86,8 +128,7 @@ class BitcoinRPC(object):
             elif self.has_submitblock == False:
                 try:
                     log.debug("Submitting Block with getblocktemplate submit: attempt #"+str(attempts))
-                    log.debug([block_hex,])
-                    resp = (yield self._call('getblocktemplate', [{'mode': 'submit', 'data': block_hex}]))
+                    resp = (yield self._call_raw(getblocktemplate_request()))
                     break
                 except Exception as e:
                     if attempts > 4:
@@ -100,14 +141,13 @@ class BitcoinRPC(object):
             else:  # self.has_submitblock = None; unable to detect submitblock, try both
                 try:
                     log.debug("Submitting Block with submitblock")
-                    log.debug([block_hex,])
-                    resp = (yield self._call('submitblock', [block_hex,]))
+                    resp = (yield self._call_raw(submitblock_request()))
                     break
                 except Exception as e:
                     try:
                         log.exception("submitblock Failed, does the coind have submitblock?")
                         log.exception("Trying GetBlockTemplate")
-                        resp = (yield self._call('getblocktemplate', [{'mode': 'submit', 'data': block_hex}]))
+                        resp = (yield self._call_raw(getblocktemplate_request()))
                         break
                     except Exception as e:
                         if attempts > 4:
@@ -150,6 +190,21 @@ class BitcoinRPC(object):
             log.exception("Cannot decode prevhash %s" % str(e))
             raise
         
+    @defer.inlineCallbacks
+    def next_block_header(self):
+        '''Returns previousblockhash, curtime, bits and height of the next
+        block in getblocktemplate format, derived from the best block of
+        the node. Bits are those of the best block. It is much faster than
+        full getblocktemplate, the node doesn't build any block.'''
+        resp = (yield self._call('getbestblockhash', []))
+        best_hash = json.loads(resp)['result']
+        resp = (yield self._call('getblock', [best_hash,]))
+        best = json.loads(resp)['result']
+        defer.returnValue({'previousblockhash': best_hash,
+                           'curtime': max(int(time.time()), best['time'] + 1),
+                           'bits': best['bits'],
+                           'height': best['height'] + 1})
+
     @defer.inlineCallbacks
     def validateaddress(self, address):
         resp = (yield self._call('validateaddress', [address,]))
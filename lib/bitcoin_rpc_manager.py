@@ -100,10 +100,10 @@ class BitcoinRPCManager(object):
               except:
                   self.next_connection()
 
-    def submitblock(self, block_hex, hash_hex, scrypt_hex):
+    def submitblock(self, block, hash_hex, scrypt_hex):
         while True:
             try:
-               return self.conns[self.curr_conn].submitblock(block_hex, hash_hex, scrypt_hex)
+               return self.conns[self.curr_conn].submitblock(block, hash_hex, scrypt_hex)
             except:
                 self.next_connection()
 
@@ -129,6 +129,13 @@ class BitcoinRPCManager(object):
             except:
                 self.next_connection()
         
+    def next_block_header(self):
+        while True:
+            try:
+                return self.conns[self.curr_conn].next_block_header()
+            except:
+                self.next_connection()
+
     def validateaddress(self, address):
         while True:
             try:
@@ -1,13 +1,15 @@
-import StringIO
 import binascii
+import json
 import struct
+import hashlib
 
 import util
 import merkletree
 import halfnode
-from coinbasetx import CoinbaseTransactionPOW
-from coinbasetx import CoinbaseTransactionPOS
 from coinbasetx import CoinbaseTransaction
+from submit_filter import SubmitFilter
+from tx_cache import TransactionCache
+from serialized_block import SerializedBlock
 import lib.logger
 log = lib.logger.get_logger('block_template')
 
@@ -26,6 +28,15 @@ class BlockTemplate(halfnode.CBlock):
     
     coinbase_transaction_class = CoinbaseTransaction
     
+    # Raw transactions shared by all templates
+    tx_cache = TransactionCache(settings.TX_CACHE_GENERATIONS)
+    
+    # Stands for the job id in pre-encoded mining.notify messages
+    notify_placeholder = '%%job_id%%'
+    
+    # Interior merkle hashes of the last template
+    merkle_cache = merkletree.IncrementalMerkleTree()
+    
     def __init__(self, timestamper, coinbaser, job_id):
         log.debug("Got To  Block_template.py")
         log.debug("Got To Block_template.py")
@@ -34,36 +45,91 @@ class BlockTemplate(halfnode.CBlock):
         self.job_id = job_id 
         self.timestamper = timestamper
         self.coinbaser = coinbaser
+        self.created = timestamper.time()
         
         self.prevhash_bin = '' # reversed binary form of prevhash
+        self.header_prefix = '' # version and prevhash in the block header form
+        self.header_nbits = ''
         self.prevhash_hex = ''
         self.timedelta = 0
         self.curtime = 0
         self.target = 0
         #self.coinbase_hex = None 
         self.merkletree = None
+        
+        # Non-coinbase transactions, already serialized
+        self.tx_count = 0
+        self.tx_blob = ''
+        self.tx_hex = None
                 
         self.broadcast_args = []
+        self.notify_fragments = {}
         
-        # List of 4-tuples (extranonce1, extranonce2, ntime, nonce)
+        # Packed (extranonce1, extranonce2, ntime, nonce) keys
         # registers already submitted and checked shares
         # There may be registered also invalid shares inside!
-        self.submits = [] 
+        self.submits = SubmitFilter(settings.DUPLICATE_FILTER_MAX_ENTRIES, settings.DUPLICATE_FILTER_BLOOM,
+                                    settings.DUPLICATE_FILTER_ERROR_RATE)
+        
+        # SHA-256 state of coinb1 + extranonce1 for every connection
+        # which submitted share for this job
+        self.coinbase_midstates = {}
+                
+    def get_state(self):
+        '''Plain data form of the template sent to front-end processes,
+        see fill_from_state. Binary fields are in hex form.
+        Submits, midstates and references to pool objects stay here.'''
+        coinbase = self.vtx[0]
+        return {'job_id': self.job_id,
+                'created': self.created,
+                'height': self.height,
+                'version': self.nVersion,
+                'previousblockhash': self.prevhash_hex,
+                'bits': "%08x" % self.nBits,
+                'curtime': self.curtime,
+                'timedelta': self.timedelta,
+                'coinbasevalue': coinbase.vout[0].nValue,
+                'coinbase_script': [ binascii.hexlify(x) for x in coinbase.vin[0]._scriptSig_template ],
+                'coinbase': [ binascii.hexlify(x) for x in coinbase._serialized ],
+                'merkle_branch': [ binascii.hexlify(x) for x in self.merkletree._steps ],
+                'tx_count': self.tx_count,
+                'tx_hex': self.tx_hex or binascii.hexlify(self.tx_blob)}
+    
+    def fill_from_state(self, state):
+        '''Rebuild template built by the master process from get_state() result'''
+        self.created = state['created']
+        self.height = state['height']
+        self.nVersion = state['version']
+        self.hashPrevBlock = int(state['previousblockhash'], 16)
+        self.nBits = int(state['bits'], 16)
+        self.hashMerkleRoot = 0
+        self.nTime = 0
+        self.nNonce = 0
+        
+        script_template = tuple([ binascii.unhexlify(x) for x in state['coinbase_script'] ])
+        serialized = tuple([ binascii.unhexlify(x) for x in state['coinbase'] ])
+        self.vtx = [ self.coinbase_transaction_class.from_fragments(script_template, serialized,
+                                                                    state['coinbasevalue']), ]
+        
+        self.tx_count = state['tx_count']
+        self.tx_blob = binascii.unhexlify(state['tx_hex'])
+        if settings.BLOCK_TAIL_HEX:
+            self.tx_hex = str(state['tx_hex'])
+        
+        self.curtime = state['curtime']
+        self.timedelta = state['timedelta']
+        self.merkletree = merkletree.MerkleTree(None, steps=[ binascii.unhexlify(x) for x in state['merkle_branch'] ])
+        self.fill_header()
                 
     def fill_from_rpc(self, data):
         '''Convert getblocktemplate result into BlockTemplate instance'''
         
         #txhashes = [None] + [ binascii.unhexlify(t['hash']) for t in data['transactions'] ]
         txhashes = [None] + [ util.ser_uint256(int(t['hash'], 16)) for t in data['transactions'] ]
-        mt = merkletree.MerkleTree(txhashes)
-        if settings.COINDAEMON_Reward == 'POW':
-            coinbase = CoinbaseTransactionPOW(self.timestamper, self.coinbaser, data['coinbasevalue'],
-                                              data['coinbaseaux']['flags'], data['height'],
-                                              settings.COINBASE_EXTRAS)
-        else:
-            coinbase = CoinbaseTransactionPOS(self.timestamper, self.coinbaser, data['coinbasevalue'],
-                                              data['coinbaseaux']['flags'], data['height'],
-                                              settings.COINBASE_EXTRAS, data['curtime'])
+        mt = self.merkle_cache.update(txhashes)
+        coinbase = self.coinbase_transaction_class(self.timestamper, self.coinbaser, data['coinbasevalue'],
+                                                   data['coinbaseaux']['flags'], data['height'],
+                                                   settings.COINBASE_EXTRAS, data['curtime'])
 
         self.height = data['height']
         self.nVersion = data['version']
@@ -74,31 +140,43 @@ class BlockTemplate(halfnode.CBlock):
         self.nNonce = 0
         self.vtx = [ coinbase, ]
         
-        for tx in data['transactions']:
-            t = halfnode.CTransaction()
-            t.deserialize(StringIO.StringIO(binascii.unhexlify(tx['data'])))
-            self.vtx.append(t)
+        # Only coinbase changes between block candidates, other transactions
+        # are kept as one raw blob appended to the coinbase on submit.
+        # Only transactions new since the previous templates are decoded.
+        self.tx_cache.new_generation()
+        self.tx_count = len(data['transactions'])
+        self.tx_blob = ''.join([ self.tx_cache.get(tx['hash'], tx['data']) for tx in data['transactions'] ])
+        if settings.BLOCK_TAIL_HEX:
+            # JSON decoder may return unicode, block is submitted as str
+            self.tx_hex = str(''.join([ tx['data'] for tx in data['transactions'] ]))
             
         self.curtime = data['curtime']
         self.timedelta = self.curtime - int(self.timestamper.time()) 
         self.merkletree = mt
+        self.fill_header()
+        
+    def fill_header(self):
+        '''Precompute fields derived from the block header, which
+        are used for broadcasting jobs and validating shares'''
         self.target = util.uint256_from_compact(self.nBits)
         
         # Reversed prevhash
-        self.prevhash_bin = binascii.unhexlify(util.reverse_hash(data['previousblockhash']))
         self.prevhash_hex = "%064x" % self.hashPrevBlock
+        self.prevhash_bin = binascii.unhexlify(util.reverse_hash(self.prevhash_hex))
+        
+        # Static parts of block header, already byte-swapped for hashing
+        self.header_prefix = struct.pack("<i", self.nVersion) + util.ser_uint256(self.hashPrevBlock)
+        self.header_nbits = struct.pack("<I", self.nBits)
         
         self.broadcast_args = self.build_broadcast_args()
+        self.notify_fragments = self.build_notify_fragments()
                 
-    def register_submit(self, extranonce1, extranonce2, ntime, nonce):
+    def register_submit(self, extranonce1_bin, extranonce2_bin, ntime_bin, nonce_bin):
         '''Client submitted some solution. Let's register it to
-        prevent double submissions.'''
+        prevent double submissions. All parameters are binary
+        and have fixed length, so simple join gives unique key.'''
         
-        t = (extranonce1, extranonce2, ntime, nonce)
-        if t not in self.submits:
-            self.submits.append(t)
-            return True
-        return False
+        return self.submits.add(extranonce1_bin + extranonce2_bin + ntime_bin + nonce_bin)
             
     def build_broadcast_args(self):
         '''Build parameters of mining.notify call. All clients
@@ -116,11 +194,37 @@ class BlockTemplate(halfnode.CBlock):
         
         return (job_id, prevhash, coinb1, coinb2, merkle_branch, version, nbits, ntime, clean_jobs)
 
-    def serialize_coinbase(self, extranonce1, extranonce2):
-        '''Serialize coinbase with given extranonce1 and extranonce2
-        in binary form'''
+    def build_notify_fragments(self):
+        '''Pre-encode mining.notify message for both values of clean_jobs.
+        Message is split into prefix and suffix around the job id,
+        which is the only part different for every connection.'''
+        fragments = {}
+        for clean_jobs in (True, False):
+            params = [ self.notify_placeholder, ] + list(self.broadcast_args[1:8]) + [ clean_jobs, ]
+            message = json.dumps({'id': None, 'method': 'mining.notify', 'params': params}) + "\n"
+            fragments[clean_jobs] = tuple(message.split(json.dumps(self.notify_placeholder)))
+        return fragments
+
+    def notify_message(self, job_id, clean_jobs):
+        '''Wire form of mining.notify for given job id (or work id)'''
+        (prefix, suffix) = self.notify_fragments[bool(clean_jobs)]
+        return prefix + '"' + job_id + '"' + suffix
+
+    def coinbase_hash(self, extranonce1, extranonce2):
+        '''Double-SHA256 hash of coinbase with given extranonce1 and extranonce2.
+        Hash state after coinb1 + extranonce1 is the same for all shares of one
+        connection, so it is computed once and only extranonce2 + coinb2
+        are hashed for every share.'''
         (part1, part2) = self.vtx[0]._serialized
-        return part1 + extranonce1 + extranonce2 + part2
+        try:
+            midstate = self.coinbase_midstates[extranonce1]
+        except KeyError:
+            midstate = hashlib.sha256(part1 + extranonce1)
+            self.coinbase_midstates[extranonce1] = midstate
+        
+        h = midstate.copy()
+        h.update(extranonce2 + part2)
+        return hashlib.sha256(h.digest()).digest()
     
     def check_ntime(self, ntime):
         '''Check for ntime restrictions.'''
@@ -134,22 +238,63 @@ class BlockTemplate(halfnode.CBlock):
         
         return True
 
-    def serialize_header(self, merkle_root_int, ntime_bin, nonce_bin):
-        '''Serialize header for calculating block hash'''
-        r  = struct.pack(">i", self.nVersion)
-        r += self.prevhash_bin
-        r += util.ser_uint256_be(merkle_root_int)
-        r += ntime_bin
-        r += struct.pack(">I", self.nBits)
-        r += nonce_bin    
-        return r       
-
-    def finalize(self, merkle_root_int, extranonce1_bin, extranonce2_bin, ntime, nonce):
+    def serialize_block_header(self, merkle_root_bin, ntime_bin, nonce_bin):
+        '''Serialize header in the form used for calculating block hash.
+        Only merkle root, ntime and nonce are patched into the precomputed
+        static parts of the header. ntime_bin and nonce_bin are big-endian,
+        as sent by the client.'''
+        return self.header_prefix + merkle_root_bin + ntime_bin[::-1] + self.header_nbits + nonce_bin[::-1]
+
+    def finalize(self, merkle_root_int, extranonce1_bin, extranonce2_bin, ntime, nonce, pow=None):
         '''Take all parameters required to compile block candidate.
-        self.is_valid() should return True then...'''
+        self.is_valid() should return True then...
+        pow is proof-of-work hash of the header if it is already known.'''
         
         self.hashMerkleRoot = merkle_root_int
         self.nTime = ntime
         self.nNonce = nonce
         self.vtx[0].set_extranonce(extranonce1_bin + extranonce2_bin)        
-        self.sha256 = None # We changed block parameters, let's reset sha256 cache
+        self.sha256 = None # We changed block parameters, let's reset hash caches
+        self.pow = pow
+
+    def memory_usage(self):
+        '''Rough estimate of memory used by the template, in bytes'''
+        size = len(self.tx_blob) + len(self.tx_hex or '')
+        if self.vtx:
+            size += sum([ len(x) for x in self.vtx[0]._serialized ])
+        if self.merkletree:
+            size += 32 * len(self.merkletree._steps)
+        size += sum([ len(p) + len(s) for (p, s) in self.notify_fragments.values() ])
+        size += self.submits.memory_usage()
+        # Key plus hash object of every midstate
+        size += len(self.coinbase_midstates) * 200
+        return size
+
+    def serialize_block(self):
+        '''Serialize block for submitblock. Only header and coinbase are serialized,
+        other transactions are taken from the pre-joined blob (or its hex form).'''
+        head = self.serialize_header() + util.ser_compact_size(self.tx_count + 1) + self.vtx[0].serialize()
+        tail = ''
+        if settings.COINDAEMON_Reward == 'POS':
+            tail = util.ser_string(self.signature)
+        return SerializedBlock(head, self.tx_blob, self.tx_hex, tail)
+
+    def serialize(self):
+        '''Serialize block in binary form'''
+        block = self.serialize_block()
+        return ''.join([ block.head, block.tx_blob, block.tail ])
+
+    def is_valid(self):
+        '''Check proof-of-work and merkle root of finalized block. Transactions
+        other than coinbase come from the coin daemon and are not checked.'''
+        self.calc_pow()
+        if self.pow > self.target:
+            return False
+
+        coinbase = self.vtx[0]
+        coinbase.sha256 = None
+        if not coinbase.is_valid():
+            return False
+
+        merkle_root = self.merkletree.withFirst(util.ser_uint256(coinbase.calc_sha256()))
+        return util.uint256_from_str(merkle_root) == self.hashMerkleRoot
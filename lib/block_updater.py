@@ -54,7 +54,7 @@ class BlockUpdater(object):
                 update = True
                 
             if update:
-                Interfaces.template_registry.update_block()
+                Interfaces.template_registry.update_block(new_block=(prevhash != current_prevhash))
 
         except Exception:
             log.exception("UpdateWatchdog.run failed")
@@ -19,6 +19,7 @@ class SimpleCoinbaser(object):
 
         self.address = address
         self.is_valid = False
+        self.script_pubkey = None
 
         self.bitcoin_rpc = bitcoin_rpc
         self._validate()
@@ -29,6 +30,8 @@ class SimpleCoinbaser(object):
         d.addErrback(self._failure)
 
     def address_check(self, result):
+        # Address or pubkey may be updated by the result
+        self.script_pubkey = None
         if result['isvalid'] and result['ismine']:
             self.is_valid = True
             log.info("Coinbase address '%s' is valid" % self.address)
@@ -70,10 +73,13 @@ class SimpleCoinbaser(object):
            raise
     
     def get_script_pubkey(self):
-        if settings.COINDAEMON_Reward == 'POW':
-            return util.script_to_address(self.address)
-        else:
-            return util.script_to_pubkey(self.pubkey)
+        # Address is decoded only once, it's the same for all templates
+        if self.script_pubkey == None:
+            if settings.COINDAEMON_Reward == 'POW':
+                self.script_pubkey = util.script_to_address(self.address)
+            else:
+                self.script_pubkey = util.script_to_pubkey(self.pubkey)
+        return self.script_pubkey
                    
     def get_coinbase_data(self):
         return ''
@@ -85,6 +91,8 @@ class SimpleCoinbaser(object):
 
         self.address = address
         self.is_valid = False
+        # Script of the old address mustn't be used anymore
+        self.script_pubkey = None
 
         self.bitcoin_rpc = bitcoin_rpc
         self._validate()
@@ -6,20 +6,30 @@ import settings
 import lib.logger
 log = lib.logger.get_logger('coinbasetx')
 
-#if settings.COINDAEMON_Reward == 'POW':
-class CoinbaseTransactionPOW(halfnode.CTransaction):
+class CoinbaseTransaction(halfnode.CTransaction):
     '''Construct special transaction used for coinbase tx.
     It also implements quick serialization using pre-cached
-    scriptSig template.'''
+    scriptSig template.
+
+    Serialized form is laid out directly from fragments. Only height,
+    time, flags and value are patched in for every template, output
+    script and other constant fields are serialized once.
+    With COINDAEMON_Reward = 'POS' also ntime is stored in the transaction.'''
     
     extranonce_type = '>Q'
     extranonce_placeholder = struct.pack(extranonce_type, int('f000000ff111111f', 16))
     extranonce_size = struct.calcsize(extranonce_type)
+    
+    # Input count and null prevout of the coinbase input
+    input_prefix = '\x01' + '\x00' * 32 + struct.pack("<I", 2**32-1)
+    
+    # (scriptPubKey, tx comment or None) -> serialized fragment from output script
+    # to the end of tx. TX mode and the comment can change on coin switch.
+    output_fragments = {}
 
-    def __init__(self, timestamper, coinbaser, value, flags, height, data):
-        super(CoinbaseTransactionPOW, self).__init__()
+    def __init__(self, timestamper, coinbaser, value, flags, height, data, ntime=None):
+        super(CoinbaseTransaction, self).__init__()
         log.debug("Got to CoinBaseTX")
-        #self.extranonce = 0
         
         if len(self.extranonce_placeholder) != self.extranonce_size:
             raise Exception("Extranonce placeholder don't match expected length!")
@@ -38,108 +48,62 @@ class CoinbaseTransactionPOW(halfnode.CTransaction):
         tx_out = halfnode.CTxOut()
         tx_out.nValue = value
         tx_out.scriptPubKey = coinbaser.get_script_pubkey()
-
+       
+        if settings.COINDAEMON_Reward == 'POS':
+            self.nTime = ntime
         if settings.COINDAEMON_TX == 'yes':
             self.strTxComment = "http://github.com/penner42/stratum-mining"
         self.vin.append(tx_in)
         self.vout.append(tx_out)
+        self.extranonce = self.extranonce_placeholder
         
         # Two parts of serialized coinbase, just put part1 + extranonce + part2 to have final serialized tx
-        self._serialized = super(CoinbaseTransactionPOW, self).serialize().split(self.extranonce_placeholder)
+        self._serialized = self._build_fragments(tx_in, tx_out)
 
-    def set_extranonce(self, extranonce):
-        if len(extranonce) != self.extranonce_size:
-            raise Exception("Incorrect extranonce size")
+    @classmethod
+    def from_fragments(cls, script_template, serialized, value):
+        '''Coinbase rebuilt from the fragments of coinbase built by another
+        process (see BlockTemplate.get_state), no coinbaser is needed'''
+        tx = cls.__new__(cls)
+        halfnode.CTransaction.__init__(tx)
         
-        (part1, part2) = self.vin[0]._scriptSig_template
-        self.vin[0].scriptSig = part1 + extranonce + part2
-#elif settings.COINDAEMON_Reward == 'POS':
-class CoinbaseTransactionPOS(halfnode.CTransaction):
-    '''Construct special transaction used for coinbase tx.
-    It also implements quick serialization using pre-cached
-    scriptSig template.'''
-    
-    extranonce_type = '>Q'
-    extranonce_placeholder = struct.pack(extranonce_type, int('f000000ff111111f', 16))
-    extranonce_size = struct.calcsize(extranonce_type)
-
-    def __init__(self, timestamper, coinbaser, value, flags, height, data, ntime):
-        super(CoinbaseTransactionPOS, self).__init__()
-        log.debug("Got to CoinBaseTX")
-        #self.extranonce = 0
-        
-        if len(self.extranonce_placeholder) != self.extranonce_size:
-            raise Exception("Extranonce placeholder don't match expected length!")
-
         tx_in = halfnode.CTxIn()
         tx_in.prevout.hash = 0L
         tx_in.prevout.n = 2**32-1
-        tx_in._scriptSig_template = (
-            util.ser_number(height) + binascii.unhexlify(flags) + util.ser_number(int(timestamper.time())) + \
-            chr(self.extranonce_size),
-            util.ser_string(coinbaser.get_coinbase_data() + data)
-        )
-                
-        tx_in.scriptSig = tx_in._scriptSig_template[0] + self.extranonce_placeholder + tx_in._scriptSig_template[1]
-    
+        tx_in._scriptSig_template = script_template
+        tx_in.scriptSig = script_template[0] + cls.extranonce_placeholder + script_template[1]
+        
         tx_out = halfnode.CTxOut()
         tx_out.nValue = value
-        tx_out.scriptPubKey = coinbaser.get_script_pubkey()
-       
-        self.nTime = ntime 
-        if settings.COINDAEMON_TX == 'yes':
-            self.strTxComment = "http://github.com/penner42/stratum-mining"
-        self.vin.append(tx_in)
-        self.vout.append(tx_out)
         
-        # Two parts of serialized coinbase, just put part1 + extranonce + part2 to have final serialized tx
-        self._serialized = super(CoinbaseTransactionPOS, self).serialize().split(self.extranonce_placeholder)
+        tx.vin.append(tx_in)
+        tx.vout.append(tx_out)
+        tx.extranonce = cls.extranonce_placeholder
+        tx._serialized = serialized
+        return tx
 
-    def set_extranonce(self, extranonce):
-        if len(extranonce) != self.extranonce_size:
-            raise Exception("Incorrect extranonce size")
+    def _build_fragments(self, tx_in, tx_out):
+        (script_part1, script_part2) = tx_in._scriptSig_template
         
-        (part1, part2) = self.vin[0]._scriptSig_template
-        self.vin[0].scriptSig = part1 + extranonce + part2
-#else:
-class CoinbaseTransaction(halfnode.CTransaction):
-    '''Construct special transaction used for coinbase tx.
-    It also implements quick serialization using pre-cached
-    scriptSig template.'''
-    
-    extranonce_type = '>Q'
-    extranonce_placeholder = struct.pack(extranonce_type, int('f000000ff111111f', 16))
-    extranonce_size = struct.calcsize(extranonce_type)
-
-    def __init__(self, timestamper, coinbaser, value, flags, height, data, ntime):
-        super(CoinbaseTransaction, self).__init__()
-        log.debug("Got to CoinBaseTX")
-        #self.extranonce = 0
+        part1 = [ struct.pack("<i", self.nVersion) ]
+        if settings.COINDAEMON_Reward == 'POS':
+            part1.append(struct.pack("<i", self.nTime))
+        part1.append(self.input_prefix)
+        part1.append(util.ser_compact_size(len(script_part1) + self.extranonce_size + len(script_part2)))
+        part1.append(script_part1)
         
-        if len(self.extranonce_placeholder) != self.extranonce_size:
-            raise Exception("Extranonce placeholder don't match expected length!")
-
-        tx_in = halfnode.CTxIn()
-        tx_in.prevout.hash = 0L
-        tx_in.prevout.n = 2**32-1
-        tx_in._scriptSig_template = (
-            util.ser_number(height) + binascii.unhexlify(flags) + util.ser_number(int(timestamper.time())) + \
-            chr(self.extranonce_size),
-            util.ser_string(coinbaser.get_coinbase_data() + data)
-        )
-                
-        tx_in.scriptSig = tx_in._scriptSig_template[0] + self.extranonce_placeholder + tx_in._scriptSig_template[1]
-    
-        tx_out = halfnode.CTxOut()
-        tx_out.nValue = value
-        tx_out.scriptPubKey = coinbaser.get_script_pubkey()
-       
-        self.nTime = ntime 
-        self.vin.append(tx_in)
-        self.vout.append(tx_out)
+        comment = self.strTxComment if settings.COINDAEMON_TX == 'yes' else None
+        try:
+            output = self.output_fragments[(tx_out.scriptPubKey, comment)]
+        except KeyError:
+            output = util.ser_string(tx_out.scriptPubKey) + struct.pack("<I", self.nLockTime)
+            if comment != None:
+                output += util.ser_string(comment)
+            self.output_fragments[(tx_out.scriptPubKey, comment)] = output
         
-        # Two parts of serialized coinbase, just put part1 + extranonce + part2 to have final serialized tx
-        self._serialized = super(CoinbaseTransaction, self).serialize().split(self.extranonce_placeholder)
+        # nSequence of the input, output count and value
+        part2 = script_part2 + struct.pack("<I", tx_in.nSequence) + '\x01' + struct.pack("<q", tx_out.nValue) + output
+        return (''.join(part1), part2)
 
     def set_extranonce(self, extranonce):
         if len(extranonce) != self.extranonce_size:
@@ -147,3 +111,8 @@ class CoinbaseTransaction(halfnode.CTransaction):
         
         (part1, part2) = self.vin[0]._scriptSig_template
         self.vin[0].scriptSig = part1 + extranonce + part2
+        self.extranonce = extranonce
+
+    def serialize(self):
+        (part1, part2) = self._serialized
+        return part1 + self.extranonce + part2
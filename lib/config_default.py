@@ -110,6 +110,7 @@ COINDAEMON_TRUSTED_PASSWORD = '***somepassword***'
 # For Reward type there is POW and POS. please ensure you choose the currect ty$
 # For SHA256 PoS Coins which support TX Messages please enter yes in the TX sel$
 COINDAEMON_ALGO = 'scrypt'
+COINDAEMON_ALGO_DIFF1 = False   # Share difficulty 1 of the algorithm instead of scrypt's (changes difficulty meaning)
 COINDAEMON_Reward = 'POW'
 COINDAEMON_SHA256_TX = 'yes'
 
@@ -200,4 +201,39 @@ DB_STATS_AVG_TIME = 300     # When using the DATABASE_EXTEND option, average spe
                 #   Note: this is also how often it updates
 DB_USERCACHE_TIME = 600     # How long the usercache is good for before we refresh
 
-
+# ******************** Share Verification Settings *********************
+SHARE_VERIFIER_PROCESSES = 0    # Number of worker processes calculating proof-of-work of shares (0 = inline)
+SHARE_VERIFIER_MAX_QUEUE = 10000    # Reject shares when this many are waiting for verification (0 = unlimited)
+SHARE_VERIFIER_BATCH_SIZE = 16  # Max shares hashed by worker process in one batch
+SHARE_VERIFIER_TIMEOUT = 30     # Fail shares of the batch not verified in this many seconds (worker process died)
+
+# Duplicate share detection
+DUPLICATE_FILTER_MAX_ENTRIES = 100000   # Shares remembered exactly per job, then the filter switches to bloom filter
+DUPLICATE_FILTER_BLOOM = False          # Use probabilistic bloom filter from the beginning
+DUPLICATE_FILTER_ERROR_RATE = 0.0001    # False positive rate of the bloom filter
+
+TARGET_CACHE_SIZE = 64          # How many difficulty to target conversions are memoized
+TX_CACHE_GENERATIONS = 2        # Transactions unused by this many last templates are evicted from the cache
+BLOCK_TAIL_HEX = False          # Keep also hex form of template transactions, saves hexlify of whole block on submit
+EMPTY_TEMPLATE_ON_NEW_BLOCK = False     # Broadcast coinbase-only template as soon as new block is detected (uses getbestblockhash)
+EMPTY_TEMPLATE_HALVING_INTERVAL = 0     # Subsidy halving interval of the coin, required by empty templates
+TEMPLATE_HISTORY_MAX_JOBS = 0   # Jobs of the current block kept for late shares (0 = unlimited)
+TEMPLATE_HISTORY_MAX_AGE = 0    # Drop jobs of the current block older than this many seconds (0 = unlimited)
+BROADCAST_CHUNK_SIZE = 500      # Connections notified about new job per reactor iteration (0 = all at once)
+
+# ******************** Multi-process Settings *********************
+FRONTEND_PROCESSES = 0          # Extra front-end processes sharing the Stratum port (SO_REUSEPORT), 0 = single process
+FRONTEND_SOCKET = '/tmp/stratum-mining/distributor.sock'   # UNIX socket used to push templates to the front-ends,
+                                # absolute path, its directory is created private to the pool user (mode 0700)
+
+# ******************** Share Admission Settings *********************
+WORKER_BAN_IP = False           # Ban also IP address of the banned worker
+SUBMIT_RATE_LIMIT = 0           # Max submits per second of one connection on average, 0 disables the limit
+SUBMIT_RATE_BURST = 100         # Max submits one connection can send at once
+
+# ******************** Worker Auth Cache Settings *********************
+AUTH_CACHE_SIZE = 100000        # Workers kept in the in-process authorization cache
+AUTH_CACHE_TIME = 300           # Successful authorization is trusted for this many seconds without memcache lookup
+AUTH_CACHE_NEGATIVE_TIME = 30   # Failed authorization is remembered for this many seconds
+WORKER_PRELOAD = False          # Load usernames and passwords of all workers into memory on startup
+WORKER_PRELOAD_REFRESH = 60     # Reload whole pool_worker table every this many seconds (new, changed and removed workers)
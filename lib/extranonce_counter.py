@@ -6,17 +6,24 @@ class ExtranonceCounter(object):
     '''Implementation of a counter producing
        unique extranonce across all pool instances.
        This is just dumb "quick&dirty" solution,
-       but it can be changed at any time without breaking anything.'''       
+       but it can be changed at any time without breaking anything.
+       
+       In multi-process mode the counter of one instance is split into
+       2**partition_bits partitions, one for every process.'''       
 
-    def __init__(self, instance_id):
+    def __init__(self, instance_id, partition=0, partition_bits=0):
         log.debug("Got to Extronance Counter")
         if instance_id < 0 or instance_id > 31:
             raise Exception("Current ExtranonceCounter implementation needs an instance_id in <0, 31>.")
         log.debug("Got To Extronance")
 
-        # Last 5 most-significant bits represents instance_id
+        if partition < 0 or partition >= 1 << partition_bits:
+            raise Exception("Extranonce partition %d doesn't fit into %d bits" % (partition, partition_bits))
+
+        # Last 5 most-significant bits represents instance_id,
+        # next partition_bits bits the partition (process).
         # The rest is just an iterator of jobs.
-        self.counter = instance_id << 27
+        self.counter = (instance_id << 27) | (partition << (27 - partition_bits))
         self.size = struct.calcsize('>L')
         
     def get_size(self):
@@ -27,3 +34,10 @@ class ExtranonceCounter(object):
         self.counter += 1
         return struct.pack('>L', self.counter)
         
+
+def get_partition_bits(partitions):
+    '''Number of bits needed for given number of partitions'''
+    bits = 0
+    while (1 << bits) < partitions:
+        bits += 1
+    return bits
@@ -18,9 +18,14 @@ from hashlib import sha256
 from util import doublesha
 
 class MerkleTree:
-    def __init__(self, data, detailed=False):
+    def __init__(self, data, detailed=False, steps=None):
         self.data = data
-        self.recalculate(detailed)
+        if steps is None:
+            self.recalculate(detailed)
+        else:
+            # Branch already calculated by IncrementalMerkleTree
+            self._steps = steps
+            self.detail = None
         self._hash_steps = None
     
     def recalculate(self, detailed=False):
@@ -63,6 +68,60 @@ class MerkleTree:
     def merkleRoot(self):
         return self.withFirst(self.data[0])
 
+class IncrementalMerkleTree(object):
+    '''Keeps hashes of all levels of the last merkle tree, with unknown
+    first leaf (coinbase). Next tree reuses all nodes which depend only
+    on the leaves shared by both trees as a common prefix, so appending
+    transactions recomputes only the right edge of the tree.'''
+    
+    def __init__(self):
+        self.levels = []
+        self.hashed = 0
+    
+    def update(self, data):
+        '''Returns MerkleTree for given leaves, data[0] is None'''
+        old_levels = self.levels
+        L = list(data)
+        
+        # Length of common prefix of old and new leaves
+        p = 0
+        if old_levels:
+            old = old_levels[0]
+            n = min(len(old), len(L))
+            while p < n and old[p] == L[p]:
+                p += 1
+        
+        levels = [L]
+        steps = []
+        self.hashed = 0
+        k = 0
+        while len(L) > 1:
+            steps.append(L[1])
+            Ll = len(L)
+            
+            # Nodes with both children inside of the prefix didn't change
+            p //= 2
+            k += 1
+            if k < len(old_levels):
+                N = old_levels[k][:p]
+            else:
+                N = []
+                p = 0
+            
+            for i in xrange(len(N), (Ll + 1) // 2):
+                if i == 0:
+                    N.append(None)
+                    continue
+                right = L[2 * i + 1] if 2 * i + 1 < Ll else L[2 * i]
+                N.append(doublesha(L[2 * i] + right))
+                self.hashed += 1
+            
+            levels.append(N)
+            L = N
+        
+        self.levels = levels
+        return MerkleTree(data, steps=steps)
+
 # MerkleTree tests
 def _test():
     import binascii
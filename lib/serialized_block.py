@@ -0,0 +1,39 @@
+'''Block candidate prepared for submitting to the coin daemon.'''
+
+import binascii
+
+# Binary data is hexlified by chunks, so no temporary string
+# of the size of whole block is created
+HEX_CHUNK_SIZE = 65536
+
+class SerializedBlock(object):
+    '''Serialized block made of binary head (header and coinbase),
+    other transactions (raw blob, or already in hex form) and binary tail.
+    Hex form is joined by chunks straight into the target string, e.g.
+    the body of JSON-RPC request.'''
+
+    def __init__(self, head, tx_blob, tx_hex=None, tail=''):
+        self.head = head
+        self.tx_blob = tx_blob
+        self.tx_hex = tx_hex
+        self.tail = tail
+
+    def hex_chunks(self):
+        '''Hex form of the block by parts of at most HEX_CHUNK_SIZE bytes
+        of binary data. Hex form of transactions is yielded as is.'''
+        for chunk in self._hex(self.head):
+            yield chunk
+        if self.tx_hex != None:
+            yield self.tx_hex
+        else:
+            for chunk in self._hex(self.tx_blob):
+                yield chunk
+        for chunk in self._hex(self.tail):
+            yield chunk
+
+    def _hex(self, data):
+        for i in xrange(0, len(data), HEX_CHUNK_SIZE):
+            yield binascii.hexlify(buffer(data, i, HEX_CHUNK_SIZE))
+
+    def __str__(self):
+        return ''.join(self.hex_chunks())
@@ -0,0 +1,163 @@
+'''Offloads proof-of-work hashing of submitted shares
+to a pool of worker processes, so share throughput scales
+with the number of cores instead of the single reactor thread.'''
+
+import multiprocessing
+from collections import deque
+from twisted.internet import reactor, defer
+
+import algorithms
+from lib.exceptions import SubmitException
+
+import lib.logger
+log = lib.logger.get_logger('share_verifier')
+
+# Worker processes shared by all verifiers (eg. after coin switch)
+_pool = None
+
+def start_pool(processes):
+    '''Fork the worker processes. Launcher calls it before the reactor
+    starts, forking the running reactor would copy its threads and sockets.'''
+    global _pool
+    if processes > 0 and _pool == None:
+        if reactor.running:
+            log.warning("Share verification processes forked after the reactor started")
+        log.info("Starting %d share verification processes" % processes)
+        _pool = multiprocessing.Pool(processes)
+    return _pool
+
+def stop_pool():
+    global _pool
+    if _pool != None:
+        _pool.terminate()
+        _pool = None
+
+def _pow_hash_worker(algo_name, headers):
+    # Runs inside of worker process. Python 2 Pool.apply_async
+    # has no error callback, so exceptions are passed back as a result
+    try:
+        return (True, algorithms.get_algorithm(algo_name).hash_batch(headers))
+    except Exception as e:
+        return (False, str(e))
+
+class ShareVerifier(object):
+    '''Calculates proof-of-work of shares and returns Deferreds.
+
+    With processes=0 hashing is done inline on the reactor thread.
+    Otherwise headers submitted during one reactor iteration are sent
+    to a multiprocessing pool in batches and results are delivered back
+    in the reactor thread. Results for a single connection are always
+    fired in the order of submission.'''
+
+    def __init__(self, algo, processes, max_queue=0, batch_size=1, timeout=30):
+        self.algo = algo
+        self.processes = processes
+        self.max_queue = max_queue
+        self.batch_size = max(1, batch_size)
+        self.timeout = timeout
+        self.queue_depth = 0
+        self.verified = 0
+        self.pending = {}
+        self.batch = []
+        self.flush_call = None
+
+        if processes > 0:
+            self.pool = start_pool(processes)
+        else:
+            self.pool = None
+
+    def check_capacity(self):
+        '''Raises SubmitException if no more shares can be queued. Call it
+        before the share is registered, so the miner can submit it again.'''
+        if self.pool != None and self.max_queue and self.queue_depth >= self.max_queue:
+            log.warning("Share verification queue is full (%d)" % self.queue_depth)
+            raise SubmitException("Server is busy, try again later")
+
+    def get_pow_hash(self, connection_key, header_bin):
+        '''Returns Deferred which fires with the proof-of-work hash
+        of given block header.'''
+
+        if self.pool == None:
+            self.verified += 1
+            return defer.succeed(self.algo.hash(header_bin))
+
+        self.check_capacity()
+
+        d = defer.Deferred()
+        entry = [d, False, None, connection_key]
+        self.pending.setdefault(connection_key, deque()).append(entry)
+        self.queue_depth += 1
+
+        self.batch.append((entry, header_bin))
+        if len(self.batch) >= self.batch_size:
+            self._flush()
+        elif self.flush_call == None:
+            # Send incomplete batch at the end of this reactor iteration
+            self.flush_call = reactor.callLater(0, self._flush)
+        return d
+
+    def _flush(self):
+        if self.flush_call != None:
+            if self.flush_call.active():
+                self.flush_call.cancel()
+            self.flush_call = None
+
+        if not self.batch:
+            return
+
+        entries = [ e for (e, _) in self.batch ]
+        headers = [ h for (_, h) in self.batch ]
+        self.batch = []
+
+        # Pool replaces worker process which died, but callback of its
+        # task never fires. Such batch fails after the timeout.
+        timeout_call = reactor.callLater(self.timeout, self._on_result, entries, (False, "timeout"))
+
+        def _on_result(result):
+            # Called in result handler thread of the pool
+            reactor.callFromThread(self._on_result, entries, result, timeout_call)
+
+        self.pool.apply_async(_pow_hash_worker, (self.algo.name, headers), callback=_on_result)
+
+    def _on_result(self, entries, result, timeout_call=None):
+        if timeout_call != None and timeout_call.active():
+            timeout_call.cancel()
+
+        (ok, values) = result
+        if not ok:
+            log.error("Share verification failed: %s" % values)
+            values = [ None ] * len(entries)
+
+        for (entry, value) in zip(entries, values):
+            if entry[1]:
+                # Already failed by the timeout
+                continue
+            self.queue_depth -= 1
+            self.verified += 1
+            entry[1] = True
+            entry[2] = value
+
+        for connection_key in set([ e[3] for e in entries ]):
+            if connection_key in self.pending:
+                self._fire(connection_key)
+
+    def _fire(self, connection_key):
+        # Fire finished results of the connection in order of submission
+        queue = self.pending[connection_key]
+        while queue and queue[0][1]:
+            (d, _, value, _) = queue.popleft()
+            if value != None:
+                d.callback(value)
+            else:
+                d.errback(SubmitException("Share verification failed"))
+
+        if not queue:
+            del self.pending[connection_key]
+
+    def get_queue_depth(self):
+        '''Returns number of shares waiting for verification'''
+        return self.queue_depth
+
+    def get_stats(self):
+        return {'algorithm': self.algo.name, 'processes': self.processes, 'queue_depth': self.queue_depth,
+                'connections': len(self.pending), 'verified': self.verified}
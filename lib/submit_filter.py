@@ -0,0 +1,115 @@
+'''Detection of duplicate share submits with bounded memory.'''
+
+import math
+import struct
+import hashlib
+
+import lib.logger
+log = lib.logger.get_logger('submit_filter')
+
+class BloomFilter(object):
+    '''Simple Bloom filter over binary keys. It may report key
+    which has never been added (false positive), never the opposite.'''
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        # Optimal size of bit array and number of hash functions
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.hashes = max(1, int(round(float(self.size) / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) / 8)
+        self.count = 0
+
+    def _positions(self, key):
+        (h1, h2) = struct.unpack("<QQ", hashlib.md5(key).digest())
+        return [ (h1 + i * h2) % self.size for i in xrange(self.hashes) ]
+
+    def add(self, key):
+        '''Adds key to the filter. Returns False if key was (probably) there already.'''
+        new = False
+        for p in self._positions(key):
+            mask = 1 << (p & 7)
+            if not self.bits[p >> 3] & mask:
+                self.bits[p >> 3] |= mask
+                new = True
+        if new:
+            self.count += 1
+        return new
+
+    def __contains__(self, key):
+        for p in self._positions(key):
+            if not self.bits[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+    def memory_usage(self):
+        return len(self.bits)
+
+class SubmitFilter(object):
+    '''Registers submitted shares of one job and detects duplicates.
+
+    Shares are stored as compact binary keys in a set. Once the set holds
+    max_entries keys, it is folded into a Bloom filter so memory stays bounded.
+    With bloom=True the Bloom filter is used from the beginning.
+
+    Full Bloom filter is rotated: it's kept as the previous generation and
+    new keys go to an empty one, so the false positive rate never grows
+    above about twice the error_rate. Keys older than two generations
+    are forgotten.'''
+
+    def __init__(self, max_entries, bloom=False, error_rate=0.0001):
+        self.max_entries = max_entries
+        self.error_rate = error_rate
+        self.duplicates = 0
+        self.previous = None
+
+        if bloom:
+            self.keys = None
+            self.bloom = BloomFilter(max_entries, error_rate)
+        else:
+            self.keys = set()
+            self.bloom = None
+
+    def add(self, key):
+        '''Registers key of the share. Returns False for duplicate submit.'''
+        if self.keys is not None:
+            if key in self.keys:
+                self.duplicates += 1
+                return False
+
+            self.keys.add(key)
+            if len(self.keys) >= self.max_entries:
+                self._to_bloom()
+            return True
+
+        if (self.previous is not None and key in self.previous) or not self.bloom.add(key):
+            self.duplicates += 1
+            return False
+
+        if self.bloom.count >= self.bloom.capacity:
+            log.info("Duplicate filter reached %d entries, rotating bloom filter" % self.bloom.count)
+            self.previous = self.bloom
+            self.bloom = BloomFilter(self.bloom.capacity, self.error_rate)
+        return True
+
+    def _to_bloom(self):
+        log.info("Duplicate filter reached %d entries, switching to bloom filter" % self.max_entries)
+        self.bloom = BloomFilter(self.max_entries * 2, self.error_rate)
+        for key in self.keys:
+            self.bloom.add(key)
+        self.keys = None
+
+    def __len__(self):
+        if self.keys is not None:
+            return len(self.keys)
+        if self.previous is not None:
+            return self.bloom.count + self.previous.count
+        return self.bloom.count
+
+    def memory_usage(self):
+        '''Rough estimate of memory used by registered keys, in bytes'''
+        if self.keys is not None:
+            # Size of string object plus slot in the set
+            return sum([ len(k) + 37 + 24 for k in self.keys ])
+        if self.previous is not None:
+            return self.bloom.memory_usage() + self.previous.memory_usage()
+        return self.bloom.memory_usage()
@@ -1,18 +1,11 @@
-import weakref
 import binascii
+import struct
+import logging
+from collections import OrderedDict
 import util
 import StringIO
 import settings
-if settings.COINDAEMON_ALGO == 'scrypt':
-    import ltc_scrypt
-elif settings.COINDAEMON_ALGO  == 'scrypt-jane':
-    import yac_scrypt
-elif settings.COINDAEMON_ALGO == 'quark':
-    import quark_hash
-elif settings.COINDAEMON_ALGO == 'skeinhash':
-    import skeinhash
-else: pass
-from twisted.internet import defer
+from twisted.internet import reactor, defer
 from lib.exceptions import SubmitException
 
 import lib.logger
@@ -20,6 +13,9 @@ log = lib.logger.get_logger('template_registry')
 log.debug("Got to Template Registry")
 from mining.interfaces import Interfaces
 from extranonce_counter import ExtranonceCounter
+from share_verifier import ShareVerifier
+from bitcoin_rpc import is_method_not_found
+import algorithms
 import lib.settings as settings
 
 
@@ -40,13 +36,20 @@ class TemplateRegistry(object):
     on valid block templates, provide internal interface for stratum
     service and implements block validation and submits.'''
     
+    # How many ids of dropped jobs are remembered with the reason
+    stale_jobs_size = 1024
+    
     def __init__(self, block_template_class, coinbaser, bitcoin_rpc, instance_id,
-                 on_template_callback, on_block_callback):
+                 on_template_callback, on_block_callback, extranonce_partition=0, extranonce_partition_bits=0):
         self.prevhashes = {}
         self.new_coin = False
-        self.jobs = weakref.WeakValueDictionary()
+        self.jobs = {}
+        self.stale_jobs = OrderedDict()
         
-        self.extranonce_counter = ExtranonceCounter(instance_id)
+        # Partition of extranonce1 space of this process, kept also on coin switch
+        self.extranonce_partition = extranonce_partition
+        self.extranonce_partition_bits = extranonce_partition_bits
+        self.extranonce_counter = ExtranonceCounter(instance_id, extranonce_partition, extranonce_partition_bits)
         self.extranonce2_size = block_template_class.coinbase_transaction_class.extranonce_size \
                 - self.extranonce_counter.get_size()
         log.debug("Got to Template Registry")
@@ -56,9 +59,24 @@ class TemplateRegistry(object):
         self.on_block_callback = on_block_callback
         self.on_template_callback = on_template_callback
         
+        # Proof-of-work algorithm resolved on startup
+        self.set_algorithm(block_template_class.algo)
+        
         self.last_block = None
+        self.last_data = None
         self.update_in_progress = False
         self.last_update = None
+        self.duplicate_shares = 0
+        
+        # Memoized targets of session difficulties
+        self.targets = OrderedDict()
+        self.target_info = self.diff_to_target(100000)
+        
+        # Coinbase-only templates on new block need subsidy halving interval of the coin
+        self.empty_templates = settings.EMPTY_TEMPLATE_ON_NEW_BLOCK
+        if self.empty_templates and not settings.EMPTY_TEMPLATE_HALVING_INTERVAL:
+            log.error("EMPTY_TEMPLATE_ON_NEW_BLOCK requires EMPTY_TEMPLATE_HALVING_INTERVAL, empty templates disabled")
+            self.empty_templates = False
         
         # Create first block template on startup
         self.update_block()
@@ -66,9 +84,11 @@ class TemplateRegistry(object):
     def update(self, block_template_class, coinbaser, bitcoin_rpc, instance_id,
                on_template_callback, on_block_callback, data):
         self.prevhashes = {}
-        self.jobs = weakref.WeakValueDictionary()
+        self.jobs = {}
+        self.stale_jobs = OrderedDict()
 
-        self.extranonce_counter = ExtranonceCounter(instance_id)
+        self.extranonce_counter = ExtranonceCounter(instance_id, self.extranonce_partition,
+                                                    self.extranonce_partition_bits)
         self.extranonce2_size = block_template_class.coinbase_transaction_class.extranonce_size \
                                 - self.extranonce_counter.get_size()
 
@@ -77,25 +97,45 @@ class TemplateRegistry(object):
         self.bitcoin_rpc = bitcoin_rpc
         self.on_block_callback = on_block_callback
         self.on_template_callback = on_template_callback
+        self.set_algorithm(block_template_class.algo)
 
         self.last_block = None
+        self.last_data = None
         self.update_in_progress = False
         self.last_update = None
+        self.duplicate_shares = 0
+
+        self.targets = OrderedDict()
+        self.target_info = self.diff_to_target(100000)
 
         # Create first block template on startup
         self._update_block(data)
 
+    def set_algorithm(self, algo):
+        '''Binds proof-of-work algorithm of the coin, also on coin switch'''
+        self.algo = algo
+        if settings.COINDAEMON_ALGO_DIFF1:
+            self.diff1 = algo.diff1
+        else:
+            # Share difficulty as pool always had it, scrypt's for all algorithms
+            self.diff1 = algorithms.SCRYPT_DIFF1
+        
+        # Proof-of-work of shares is calculated by the verifier,
+        # possibly in a pool of worker processes
+        self.share_verifier = ShareVerifier(algo, settings.SHARE_VERIFIER_PROCESSES,
+                                            settings.SHARE_VERIFIER_MAX_QUEUE, settings.SHARE_VERIFIER_BATCH_SIZE,
+                                            settings.SHARE_VERIFIER_TIMEOUT)
+
     def get_new_extranonce1(self):
         '''Generates unique extranonce1 (e.g. for newly
         subscribed connection.'''
         log.debug("Getting Unique Extronance")
         return self.extranonce_counter.get_new_bin()
     
-    def get_last_broadcast_args(self):
-        '''Returns arguments for mining.notify
-        from last known template.'''
-        log.debug("Getting Last Template")
-        return self.last_block.broadcast_args
+    def get_last_template(self):
+        '''Returns last known template, it prepares
+        pre-encoded mining.notify messages.'''
+        return self.last_block
         
     def add_template(self, block, block_height):
         """Adds new template to the registry.
@@ -113,8 +153,9 @@ class TemplateRegistry(object):
         # Blocks sorted by prevhash, so it's easy to drop
         # them on blockchain update
         self.prevhashes[prevhash].append(block)
+        self._trim_history(self.prevhashes[prevhash])
         
-        # Weak reference for fast lookup using job_id
+        # Index of valid jobs, templates are removed as soon as they are dropped
         self.jobs[block.job_id] = block
         
         # Use this template for every new request
@@ -123,6 +164,8 @@ class TemplateRegistry(object):
         # Drop templates of obsolete blocks
         for ph in self.prevhashes.keys():
             if ph != prevhash:
+                for template in self.prevhashes[ph]:
+                    self._drop_job(template, "block changed")
                 del self.prevhashes[ph]
                 
         log.info("New template for %s" % prevhash)
@@ -135,6 +178,46 @@ class TemplateRegistry(object):
         # Everything is ready, let's broadcast jobs!
         self.on_template_callback(new_block)
 
+    def _trim_history(self, templates):
+        '''Drop the oldest templates of the block over TEMPLATE_HISTORY_MAX_JOBS
+        or older than TEMPLATE_HISTORY_MAX_AGE. The newest one is always kept.'''
+        now = Interfaces.timestamper.time()
+        while len(templates) > 1:
+            if settings.TEMPLATE_HISTORY_MAX_JOBS and len(templates) > settings.TEMPLATE_HISTORY_MAX_JOBS:
+                reason = "dropped from template history"
+            elif settings.TEMPLATE_HISTORY_MAX_AGE and now - templates[0].created > settings.TEMPLATE_HISTORY_MAX_AGE:
+                reason = "older than %d sec" % settings.TEMPLATE_HISTORY_MAX_AGE
+            else:
+                break
+            
+            template = templates.pop(0)
+            self._drop_job(template, reason)
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("Job %s %s, %d bytes freed" % (template.job_id, reason, template.memory_usage()))
+    
+    def _drop_job(self, template, reason):
+        '''Remove template from the job index and remember why'''
+        job_id = template.job_id
+        if self.jobs.get(job_id) is template:
+            del self.jobs[job_id]
+        
+        self.stale_jobs.pop(job_id, None)
+        self.stale_jobs[job_id] = reason
+        if len(self.stale_jobs) > self.stale_jobs_size:
+            self.stale_jobs.popitem(last=False)
+    
+    def get_template_stats(self):
+        '''Returns job id, age, transactions, submits and estimated
+        memory usage of every template in the history'''
+        now = Interfaces.timestamper.time()
+        stats = []
+        for (prevhash, templates) in self.prevhashes.items():
+            for template in templates:
+                stats.append({'job_id': template.job_id, 'prevhash': prevhash, 'age': int(now - template.created),
+                              'transactions': template.tx_count, 'submits': len(template.submits),
+                              'memory': template.memory_usage()})
+        return stats
+
     def wait_for_update(self):
         if self.update_in_progress:
             log.info("change coin while update in progress, wait for finish")
@@ -142,9 +225,10 @@ class TemplateRegistry(object):
         else:
             return defer.succeed(True)
 
-    def update_block(self):
+    def update_block(self, new_block=False):
         """Registry calls the getblocktemplate() RPC
-        and build new block template."""
+        and build new block template. new_block is set
+        by notifications about new block on the network."""
         
         if self.update_in_progress:
             # Block has been already detected
@@ -154,6 +238,12 @@ class TemplateRegistry(object):
         self.update_in_progress = True
         self.last_update = Interfaces.timestamper.time()
         
+        if new_block and self.empty_templates and self.last_data != None:
+            # Start mining on new block right away, full template follows
+            d = self.bitcoin_rpc.next_block_header()
+            d.addCallback(self._update_empty_block)
+            d.addErrback(self._update_block_failed_empty)
+        
         self.d = self.bitcoin_rpc.getblocktemplate()
         self.d.addCallback(self._update_block)
         self.d.addErrback(self._update_block_failed)
@@ -163,50 +253,97 @@ class TemplateRegistry(object):
         log.error(str(failure))
         self.update_in_progress = False
         
+    def _update_empty_block(self, header):
+        '''Build coinbase-only template on top of new prevhash. Header and
+        height come from the node, subsidy from the last full template
+        without its fees, when both heights are in the same halving interval.'''
+        if not self.update_in_progress or \
+                header['previousblockhash'] == self.last_block.prevhash_hex:
+            # Full template is ready already or there's no new block
+            return
+        
+        interval = settings.EMPTY_TEMPLATE_HALVING_INTERVAL
+        if header['height'] / interval != self.last_data['height'] / interval:
+            log.info("Subsidy halving at height %d, waiting for full template" % header['height'])
+            return
+        
+        data = dict(self.last_data)
+        data.update(header)
+        data['coinbasevalue'] = self.last_data['subsidy']
+        data['transactions'] = []
+        
+        template = self.block_template_class(Interfaces.timestamper, self.coinbaser, JobIdGenerator.get_new_id())
+        template.fill_from_rpc(data)
+        self.add_template(template, data['height'])
+        
+        log.info("Empty template for new block %s broadcasted" % header['previousblockhash'])
+    
+    def _update_block_failed_empty(self, failure):
+        if is_method_not_found(failure.value):
+            # Coin daemon without getbestblockhash, don't ask again on every block
+            log.error("Coin daemon can't provide header of the next block, disabling empty templates: %s" % \
+                      str(failure))
+            self.empty_templates = False
+        else:
+            log.error("Cannot build empty template: %s" % str(failure))
+        
     def _update_block(self, data):
         start = Interfaces.timestamper.time()
                 
         template = self.block_template_class(Interfaces.timestamper, self.coinbaser, JobIdGenerator.get_new_id())
         log.info(template.fill_from_rpc(data))
         self.add_template(template, data['height'])
+        
+        # Everything but transactions, to build empty template on the next block
+        self.last_data = dict([ (k, v) for (k, v) in data.items() if k != 'transactions' ])
+        self.last_data['subsidy'] = data['coinbasevalue'] - sum([ t.get('fee', 0) for t in data['transactions'] ])
 
         log.info("Update finished, %.03f sec, %d txes" % \
-                    (Interfaces.timestamper.time() - start, len(template.vtx)))
+                    (Interfaces.timestamper.time() - start, template.tx_count + 1))
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Transaction cache: %s", template.tx_cache.get_stats())
         
         self.update_in_progress = False        
         return True
     
+    def _check_block(self, job, block, header_bin):
+        '''Check already submitted block candidate from scratch. Serialized
+        block is checked, the job itself may be finalized by another
+        block candidate meanwhile.'''
+        header = block.head[:80]
+        coinbase = block.head[80 + len(util.ser_compact_size(job.tx_count + 1)):]
+        merkle_root = job.merkletree.withFirst(util.doublesha(coinbase))
+        pow = util.uint256_from_str(self.algo.hash(header))
+        if header != header_bin or header[36:68] != merkle_root or pow > job.target:
+            # Should not happen
+            log.error("FINAL JOB VALIDATION FAILED!(Try enabling/disabling tx messages)")
+
     def diff_to_target(self, difficulty):
         """Converts difficulty to target"""
-        if settings.COINDAEMON_ALGO == 'scrypt' or 'scrypt-jane':
-            diff1 = 0x0000ffff00000000000000000000000000000000000000000000000000000000
-        elif settings.COINDAEMON_ALGO == 'quark':
-            diff1 = 0x000000ffff000000000000000000000000000000000000000000000000000000
-        else:
-            diff1 = 0x00000000ffff0000000000000000000000000000000000000000000000000000
-
-        return diff1 / difficulty
+        return self.diff1 / difficulty
     
-    def get_job(self, job_id):
-        """For given job_id returns BlockTemplate instance or None"""
+    def get_target(self, difficulty):
+        """Memoized diff_to_target for session difficulties.
+        Returns target and its 64 most significant bits,
+        which are used for quick rejection of shares."""
         try:
-            j = self.jobs[job_id]
-        except:
-            log.debug("Job id '%s' not found" % job_id)
-            return None
-        
-        # Now we have to check if job is still valid.
-        # Unfortunately weak references are not bulletproof and
-        # old reference can be found until next run of garbage collector.
-        if j.prevhash_hex not in self.prevhashes:
-            log.info("Prevhash of job '%s' is unknown" % job_id)
-            return None
+            # Move to the end, least recently used target is dropped first
+            entry = self.targets.pop(difficulty)
+            self.targets[difficulty] = entry
+            return entry
+        except KeyError:
+            pass
         
-        if j not in self.prevhashes[j.prevhash_hex]:
-            log.info("Job %s is unknown" % job_id)
-            return None
-        
-        return j
+        target = self.diff_to_target(difficulty)
+        if len(self.targets) >= settings.TARGET_CACHE_SIZE:
+            # Vardiff uses only few difficulties, so drop the least recently used one
+            self.targets.popitem(last=False)
+        self.targets[difficulty] = (target, long(target) >> 192)
+        return self.targets[difficulty]
+    
+    def get_job(self, job_id):
+        """For given job_id returns BlockTemplate instance or None"""
+        return self.jobs.get(job_id)
         
     def submit_share(self, job_id, worker_name, session, extranonce1_bin, extranonce2, ntime, nonce,
                      difficulty):
@@ -218,6 +355,9 @@ class TemplateRegistry(object):
             - job_id, extranonce2, ntime, nonce - in hex form sent by the client
             - difficulty - decimal number from session, again no checks performed
             - submitblock_callback - reference to method which receive result of submitblock()
+
+           Returns Deferred, proof-of-work is calculated by share verifier.
+           Shares of one connection (session) are finished in order of submission.
         '''
         
         # Check if extranonce2 looks correctly. extranonce2 is in hex form...
@@ -227,6 +367,8 @@ class TemplateRegistry(object):
         # Check for job
         job = self.get_job(job_id)
         if job == None:
+            if job_id in self.stale_jobs:
+                raise SubmitException("Stale share, job '%s' %s" % (job_id, self.stale_jobs[job_id]))
             raise SubmitException("Job '%s' not found" % job_id)
                 
         # Check if ntime looks correct
@@ -240,59 +382,64 @@ class TemplateRegistry(object):
         if len(nonce) != 8:
             raise SubmitException("Incorrect size of nonce. Expected 8 chars")
         
+        # Some sugar
+        try:
+            extranonce2_bin = binascii.unhexlify(extranonce2)
+            ntime_bin = binascii.unhexlify(ntime)
+            nonce_bin = binascii.unhexlify(nonce)
+        except TypeError:
+            raise SubmitException("Share data are not in hex form")
+        
+        # Refuse the share before it's registered, retry wouldn't be a duplicate
+        self.share_verifier.check_capacity()
+        
         # Check for duplicated submit
-        if not job.register_submit(extranonce1_bin, extranonce2, ntime, nonce):
-            log.info("Duplicate from %s, (%s %s %s %s)" % \
-                    (worker_name, binascii.hexlify(extranonce1_bin), extranonce2, ntime, nonce))
+        if not job.register_submit(extranonce1_bin, extranonce2_bin, ntime_bin, nonce_bin):
+            self.duplicate_shares += 1
+            log.info("Duplicate from %s, (%s %s %s %s), %d duplicates on job %s" % \
+                    (worker_name, binascii.hexlify(extranonce1_bin), extranonce2, ntime, nonce,
+                     job.submits.duplicates, job_id))
             raise SubmitException("Duplicate share")
         
         # Now let's do the hard work!
         # ---------------------------
         
-        # 0. Some sugar
-        extranonce2_bin = binascii.unhexlify(extranonce2)
-        ntime_bin = binascii.unhexlify(ntime)
-        nonce_bin = binascii.unhexlify(nonce)
-                
         # 1. Build coinbase
-        coinbase_bin = job.serialize_coinbase(extranonce1_bin, extranonce2_bin)
-        coinbase_hash = util.doublesha(coinbase_bin)
+        coinbase_hash = job.coinbase_hash(extranonce1_bin, extranonce2_bin)
         
         # 2. Calculate merkle root
         merkle_root_bin = job.merkletree.withFirst(coinbase_hash)
-        merkle_root_int = util.uint256_from_str(merkle_root_bin)
                 
-        # 3. Serialize header with given merkle, ntime and nonce
-        header_bin = job.serialize_header(merkle_root_int, ntime_bin, nonce_bin)
+        # 3. Serialize header with given merkle, ntime and nonce.
+        # It is already in the reversed form used by all hashes below.
+        header_bin = job.serialize_block_header(merkle_root_bin, ntime_bin, nonce_bin)
     
-        # 4. Reverse header and compare it with target of the user
-        if settings.COINDAEMON_ALGO == 'scrypt':
-            hash_bin = ltc_scrypt.getPoWHash(''.join([ header_bin[i*4:i*4+4][::-1] for i in range(0, 20) ]))
-        elif settings.COINDAEMON_ALGO  == 'scrypt-jane':
-            hash_bin = yac_scrypt.getPoWHash(''.join([ header_bin[i*4:i*4+4][::-1] for i in range(0, 20) ]), int(ntime, 16))
-        elif settings.COINDAEMON_ALGO == 'quark':
-            hash_bin = quark_hash.getPoWHash(''.join([ header_bin[i*4:i*4+4][::-1] for i in range(0, 20) ]))
-        elif settings.COINDAEMON_ALGO == 'skeinhash':
-            hash_bin = skeinhash.skeinhash(''.join([ header_bin[i*4:i*4+4][::-1] for i in range(0, 20) ]))
-        else:
-            hash_bin = util.doublesha(''.join([ header_bin[i*4:i*4+4][::-1] for i in range(0, 20) ]))
+        # 4. Let the verifier calculate hash of the header
+        d = self.share_verifier.get_pow_hash(id(session), header_bin)
+        d.addCallback(self._finish_share, job, header_bin, merkle_root_bin, extranonce1_bin, extranonce2_bin,
+                      ntime, nonce, difficulty)
+        return d
+
+    def _finish_share(self, hash_bin, job, header_bin, merkle_root_bin, extranonce1_bin, extranonce2_bin,
+                      ntime, nonce, difficulty):
+        '''Compare hash of the share with targets and submit
+        block candidate to the network.'''
 
+        # Most of shares are above the target, so compare
+        # the most significant 64 bits of the hash first
+        (target_user, target_user_high) = self.get_target(difficulty)
+        if struct.unpack("<Q", hash_bin[24:32])[0] > target_user_high:
+            raise SubmitException("Share is above target")
+        
         hash_int = util.uint256_from_str(hash_bin)
-        scrypt_hash_hex = "%064x" % hash_int
-        header_hex = binascii.hexlify(header_bin)
-        if settings.COINDAEMON_ALGO == 'scrypt' or settings.COINDAEMON_ALGO == 'scrypt-jane':
-            header_hex = header_hex+"000000800000000000000000000000000000000000000000000000000000000000000000000000000000000080020000"
-        elif settings.COINDAEMON_ALGO == 'quark':
-            header_hex = header_hex+"000000800000000000000000000000000000000000000000000000000000000000000000000000000000000080020000"
-        else: pass
-                 
-        target_user = self.diff_to_target(difficulty)
         if hash_int > target_user:
             raise SubmitException("Share is above target")
 
+        scrypt_hash_hex = "%064x" % hash_int
+        header_hex = binascii.hexlify(util.reverse_words(header_bin)) + self.algo.header_suffix
+
         # Mostly for debugging purposes
-        target_info = self.diff_to_target(100000)
-        if hash_int <= target_info:
+        if hash_int <= self.target_info:
             log.info("Yay, share with diff above 100000")
 
         # Algebra tells us the diff_to_target is the same as hash_to_diff
@@ -303,27 +450,25 @@ class TemplateRegistry(object):
             # Yay! It is block candidate! 
             log.info("We found a block candidate! %s" % scrypt_hash_hex)
 
-            # Reverse the header and get the potential block hash (for scrypt only) 
-            #if settings.COINDAEMON_ALGO == 'scrypt' or settings.COINDAEMON_ALGO == 'sha256d':
-            #   if settings.COINDAEMON_Reward == 'POW':
-            block_hash_bin = util.doublesha(''.join([ header_bin[i*4:i*4+4][::-1] for i in range(0, 20) ]))
+            # Get the potential block hash
+            block_hash_bin = util.doublesha(header_bin)
             block_hash_hex = block_hash_bin[::-1].encode('hex_codec')
             #else:   block_hash_hex = hash_bin[::-1].encode('hex_codec')
             #else:  block_hash_hex = hash_bin[::-1].encode('hex_codec')
-            # 6. Finalize and serialize block object 
-            job.finalize(merkle_root_int, extranonce1_bin, extranonce2_bin, int(ntime, 16), int(nonce, 16))
-            
-            if not job.is_valid():
-                # Should not happen
-                log.exception("FINAL JOB VALIDATION FAILED!(Try enabling/disabling tx messages)")
+            # 6. Finalize block object, reusing hash and merkle root calculated above
+            job.finalize(util.uint256_from_str(merkle_root_bin), extranonce1_bin, extranonce2_bin, int(ntime, 16),
+                         int(nonce, 16), hash_int)
                             
             # 7. Submit block to the network
-            serialized = binascii.hexlify(job.serialize())
+            serialized = job.serialize_block()
             #just try both block hash and scrypt hash when checking for block creation
             on_submit = self.bitcoin_rpc.submitblock(serialized, block_hash_hex, scrypt_hash_hex)
 
+            # Full consistency check doesn't delay the block propagation
+            reactor.callLater(0, self._check_block, job, serialized, header_bin)
+
             if on_submit:
-                self.update_block()
+                self.update_block(new_block=True)
 
             if settings.SOLUTION_BLOCK_HASH:
                 return (header_hex, block_hash_hex, share_diff, on_submit)
@@ -333,7 +478,7 @@ class TemplateRegistry(object):
         
         if settings.SOLUTION_BLOCK_HASH:
         # Reverse the header and get the potential block hash (for scrypt only) only do this if we want to send in the block hash to the shares table
-            block_hash_bin = util.doublesha(''.join([ header_bin[i*4:i*4+4][::-1] for i in range(0, 20) ]))
+            block_hash_bin = util.doublesha(header_bin)
             block_hash_hex = block_hash_bin[::-1].encode('hex_codec')
             return (header_hex, block_hash_hex, share_diff, None)
         else:
@@ -0,0 +1,57 @@
+'''Cache of raw transactions shared by block templates.
+
+Most of the mempool doesn't change between two getblocktemplate calls,
+so transactions are decoded only once and reused by following templates.'''
+
+import binascii
+
+import lib.logger
+log = lib.logger.get_logger('tx_cache')
+
+class TransactionCache(object):
+    '''Raw (binary) transactions keyed by txid.
+
+    Every template build is one generation. Transactions which were not
+    used by any of the last max_generations templates are evicted, so the cache
+    holds only transactions of recent mempool snapshots.'''
+
+    def __init__(self, max_generations=2):
+        self.max_generations = max(1, max_generations)
+        self.generations = [ {} ]
+        self.hits = 0
+        self.misses = 0
+
+    def new_generation(self):
+        '''Starts building of new template'''
+        self.generations.insert(0, {})
+        del self.generations[self.max_generations:]
+
+    def get(self, txid, data_hex):
+        '''Returns raw transaction for given txid, decodes data_hex only when
+        the transaction is not in the cache yet.'''
+        current = self.generations[0]
+        try:
+            return current[txid]
+        except KeyError:
+            pass
+
+        for generation in self.generations[1:]:
+            tx = generation.get(txid)
+            if tx != None:
+                self.hits += 1
+                current[txid] = tx
+                return tx
+
+        self.misses += 1
+        tx = binascii.unhexlify(data_hex)
+        current[txid] = tx
+        return tx
+
+    def __len__(self):
+        '''Transactions of the current generation'''
+        return len(self.generations[0])
+
+    def get_stats(self):
+        # Entries of all generations, transactions used by several templates are counted more times
+        return {'transactions': len(self), 'entries': sum([ len(g) for g in self.generations ]),
+                'hits': self.hits, 'misses': self.misses}
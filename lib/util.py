@@ -74,19 +74,20 @@ def deser_vector(f, c):
         r.append(t)
     return r
 
+def ser_compact_size(n):
+    if n < 253:
+        return chr(n)
+    elif n < 0x10000:
+        return chr(253) + struct.pack("<H", n)
+    elif n < 0x100000000L:
+        return chr(254) + struct.pack("<I", n)
+    return chr(255) + struct.pack("<Q", n)
+
 def ser_vector(l):
-    r = ""
-    if len(l) < 253:
-        r = chr(len(l))
-    elif len(l) < 0x10000:
-        r = chr(253) + struct.pack("<H", len(l))
-    elif len(l) < 0x100000000L:
-        r = chr(254) + struct.pack("<I", len(l))
-    else:
-        r = chr(255) + struct.pack("<Q", len(l))
+    r = [ ser_compact_size(len(l)) ]
     for i in l:
-        r += i.serialize()
-    return r
+        r.append(i.serialize())
+    return ''.join(r)
 
 def deser_uint256_vector(f):
     nit = struct.unpack("<B", f.read(1))[0]
@@ -165,6 +166,11 @@ def reverse_hash(h):
 def doublesha(b):
     return sha256(sha256(b).digest()).digest()
 
+def reverse_words(b):
+    '''Reverse byte order of every 4-byte word'''
+    n = len(b) / 4
+    return struct.pack(">%dI" % n, *struct.unpack("<%dI" % n, b))
+
 def bits_to_target(bits):
     return struct.unpack('<L', bits[:3] + b'\0')[0] * 2**(8*(int(bits[3], 16) - 3))
 
@@ -1,4 +1,7 @@
 ''' A simple wrapper for pylibmc. It can be overwritten with simple hashing if necessary '''
+import time
+from collections import OrderedDict
+
 import lib.settings as settings
 import lib.logger
 log = lib.logger.get_logger('Cache')
@@ -22,3 +25,37 @@ class Cache():
 
     def exists(self, key):
         return str(key) in self.mc.get(settings.MEMCACHE_PREFIX + str(key))
+
+class LocalCache(object):
+    ''' In-process cache with expiration of entries and limited size.
+    Least recently used entries are dropped when it's full. '''
+    def __init__(self, max_size, timestamper=time.time):
+        self.max_size = max_size
+        self.timestamper = timestamper
+        # key -> (expires, value), oldest first
+        self.entries = OrderedDict()
+
+    def set(self, key, value, ttl):
+        self.entries.pop(key, None)
+        self.entries[key] = (self.timestamper() + ttl, value)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def get(self, key):
+        entry = self.entries.pop(key, None)
+        if entry == None:
+            return None
+        if entry[0] <= self.timestamper():
+            return None
+        # Move to the end, it's the most recently used now
+        self.entries[key] = entry
+        return entry[1]
+
+    def delete(self, key):
+        return self.entries.pop(key, None) != None
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
@@ -1,26 +1,40 @@
 from twisted.internet import reactor, defer
+from twisted.python import failure
 import time
+import hashlib
 from datetime import datetime
 import Queue
 import signal
 import Cache
-from sets import Set
 
 import lib.settings as settings
 
 import lib.logger
 log = lib.logger.get_logger('DBInterface')
 
+allowed_chars = frozenset('0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_-.')
+
 class DBInterface():
     def __init__(self):
         self.dbi = self.connectDB()
+        # (query name, key) -> Deferreds waiting for the query in progress
+        self.in_flight = {}
+        self.cache = Cache.Cache()
+        # username -> password of authorized worker, answers most
+        # of the authorizations without asking memcache.
+        # Failed ones are keyed by username and hash of the password.
+        self.auth_cache = Cache.LocalCache(settings.AUTH_CACHE_SIZE)
+        # username -> password of preloaded pool_worker table
+        self.workers = None
+        # Only the latest of overlapping loads is used
+        self.workers_load = 0
 
-    # TODO get rid of this, and put it in __init__?
     def init_main(self):
+        '''Start the share writer. Only the master process (the single
+        DB writer) calls it on startup, front-ends just read the database.'''
         self.dbi.check_tables()
         self.q = Queue.Queue()
         self.queueclock = None
-        self.cache = Cache.Cache()
         self.nextStatsUpdate = 0
         self.scheduleImport()
         self.next_force_import_time = time.time() + settings.DB_LOADER_FORCE_TIME
@@ -49,6 +63,43 @@ class DBInterface():
         self.do_import(self.dbi, False)
         self.scheduleImport()
 
+    def start_workers_preload(self):
+        '''Load workers into memory and keep them fresh, if WORKER_PRELOAD
+        is enabled. Every process checking passwords calls it on startup.'''
+        if settings.WORKER_PRELOAD:
+            self.run_workers_refresh()
+
+    def schedule_workers_refresh(self):
+        reactor.callLater(settings.WORKER_PRELOAD_REFRESH, self.run_workers_refresh)
+
+    def run_workers_refresh(self):
+        d = self.reload_workers()
+        d.addBoth(lambda result: self.schedule_workers_refresh())
+
+    def reload_workers(self):
+        d = self.load_workers()
+        d.addErrback(lambda failure: log.error("Loading of workers failed: %s", failure.getErrorMessage()))
+        return d
+
+    @defer.inlineCallbacks
+    def load_workers(self):
+        '''Load whole pool_worker table, so also changed passwords
+        and removed workers are picked up'''
+        self.workers_load += 1
+        load = self.workers_load
+        rows = yield self.dbi.get_workers()
+        if load != self.workers_load:
+            # Newer load is in progress (eg. after invalidation of all workers)
+            return
+
+        # New index is built aside, the old one serves meanwhile
+        workers = {}
+        for (username, password) in rows:
+            workers[str(username)] = str(password)
+
+        self.workers = workers
+        log.debug("Loaded %d workers", len(workers))
+
     def wait_for_import(self):
         if self.import_in_progress:
             log.info("waiting for import to finish...")
@@ -104,31 +155,106 @@ class DBInterface():
         except Exception as e:
             log.error("Update Found Block Share Record Failed: %s", e.args[0])
 
-    @defer.inlineCallbacks
     def check_password(self, username, password):
         if username == "":
             log.info("Rejected worker for blank username")
-            defer.returnValue(False)
-        allowed_chars = Set('0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_-.')
-        if Set(username).issubset(allowed_chars) != True:
+            return defer.succeed(False)
+        if not allowed_chars.issuperset(username):
             log.info("Username contains bad arguments")
-            defer.returnValue(False)
+            return defer.succeed(False)
         if username.count('.') > 1:
             log.info("Username contains multiple . ")
-            defer.returnValue(False)
-        
+            return defer.succeed(False)
+
+        # Worker submitting shares is answered from the memory
+        cached = self.auth_cache.get(username)
+        if cached != None and cached == password:
+            return defer.succeed(True)
+        if self.auth_cache.get(self._failed_auth_key(username, password)) != None:
+            return defer.succeed(False)
+
+        d = self._single_flight(('check_password', username, password), self._check_password, username, password)
+        d.addCallback(self._cache_auth, username, password)
+        return d
+
+    def _single_flight(self, key, func, *args):
+        '''Call func unless the call with the same key is in progress already.
+        Concurrent callers (eg. rigs of one farm reconnecting at once)
+        get result of the first call instead of running their own queries.'''
+        waiters = self.in_flight.get(key)
+        if waiters != None:
+            d = defer.Deferred()
+            waiters.append(d)
+            return d
+
+        waiters = self.in_flight[key] = []
+
+        def _done(result):
+            del self.in_flight[key]
+            for waiter in waiters:
+                if isinstance(result, failure.Failure):
+                    # Every waiter gets its own failure, its errbacks may trap or consume it
+                    waiter.errback(failure.Failure(result.value, result.type, result.tb))
+                else:
+                    waiter.callback(result)
+            return result
+
+        d = defer.maybeDeferred(func, *args)
+        d.addBoth(_done)
+        return d
+
+    def _cache_auth(self, result, username, password):
+        if result:
+            self.auth_cache.set(username, password, settings.AUTH_CACHE_TIME)
+        else:
+            # Failed authorizations are remembered only shortly, the worker may
+            # be added to the database meanwhile. Wrong password doesn't evict
+            # authorization of the worker, it's stored under its own key.
+            self.auth_cache.set(self._failed_auth_key(username, password), False,
+                                settings.AUTH_CACHE_NEGATIVE_TIME)
+        return result
+
+    def _failed_auth_key(self, username, password):
+        if isinstance(password, unicode):
+            password = password.encode('utf-8')
+        return (username, hashlib.sha256(str(password)).digest())
+
+    def invalidate_worker(self, username=None):
+        '''Forget cached authorization of the worker,
+        or of all workers when username is None'''
+        if username == None:
+            self.auth_cache.clear()
+            if self.workers != None:
+                # Passwords are checked in the database until the reload finishes
+                self.workers = None
+                self.reload_workers()
+        else:
+            self.auth_cache.delete(username)
+            self.cache.delete(str(username))
+            if self.workers != None:
+                self.workers.pop(str(username), None)
+
+    @defer.inlineCallbacks
+    def _check_password(self, username, password):
         # Force username and password to be strings
         username = str(username)
         password = str(password)
+        if self.workers != None and username in self.workers:
+            # Workers missing in the preloaded table or with changed
+            # password are checked in the database as usual
+            if not settings.USERS_CHECK_PASSWORD or self.workers[username] == password:
+                defer.returnValue(True)
         if not settings.USERS_CHECK_PASSWORD and (yield self.user_exists(username)):
             defer.returnValue(True)
         elif self.cache.get(username) == password:
             defer.returnValue(True)
         elif (yield defer.maybeDeferred(self.dbi.check_password, username, password)):
             self.cache.set(username, password)
+            if self.workers != None:
+                self.workers[username] = password
             defer.returnValue(True)
         elif settings.USERS_AUTOADD == True:
-            uid = yield defer.maybeDeferred(self.dbi.get_uid, username)
+            uid = yield self.get_uid(username)
             if uid != False:
                 self.dbi.insert_worker(uid, username, password)
                 self.cache.set(username, password)
@@ -140,22 +266,32 @@ class DBInterface():
     # def list_users(self):
     #     return self.dbi.list_users()
 
-    @defer.inlineCallbacks
     def get_user_nb(self, id):
+        return self._single_flight(('get_user_nb', id), self._get_user_nb, id)
+
+    @defer.inlineCallbacks
+    def _get_user_nb(self, id):
         if self.cache.get(id) is None:
             user = yield defer.maybeDeferred(self.dbi.get_user_nb, id)
             self.cache.set(id, user)
         user = self.cache.get(id)
         defer.returnValue(user)
 
-    @defer.inlineCallbacks
     def get_user(self, id):
+        return self._single_flight(('get_user', id), self._get_user, id)
+
+    @defer.inlineCallbacks
+    def _get_user(self, id):
         if self.cache.get(id) is None:
             log.debug("%s not in cache" % id)
             user = yield defer.maybeDeferred(self.dbi.get_user, id)
             ret = self.cache.set(id, user)
         defer.returnValue(self.cache.get(id))
 
+    def get_uid(self, username):
+        # Workers of one account share the query
+        return self._single_flight(('get_uid', username.split('.', 1)[0]), self.dbi.get_uid, username)
+
     @defer.inlineCallbacks
     def user_exists(self, username):
         if self.cache.get(username) is not None:
@@ -196,6 +196,16 @@ class DB_Mysql():
             }
         )
 
+    def get_workers(self):
+        log.debug("Loading all workers")
+
+        return self.fetchall_nb(
+            """
+            SELECT `username`, `password`
+            FROM `pool_worker`
+            """
+        )
+
     @defer.inlineCallbacks
     def get_uid(self, id_or_username):
         log.debug("Finding user id of %s", id_or_username)
@@ -5,8 +5,6 @@ from twisted.internet.error import ConnectionRefusedError
 import time
 import simplejson as json
 from twisted.internet import reactor
-import threading
-from mining.work_log_pruner import WorkLogPruner
 
 @defer.inlineCallbacks
 def setup(on_startup):
@@ -22,7 +20,14 @@ def setup(on_startup):
     import lib.logger
     log = lib.logger.get_logger('mining')
 
-    from interfaces import Interfaces
+    from interfaces import Interfaces, dbi
+    
+    # This process is the single DB writer, front-ends only read
+    dbi.init_main()
+    dbi.start_workers_preload()
+    if settings.VARIABLE_DIFF:
+        # Vardiff starts every worker at POOL_TARGET again
+        dbi.clear_worker_diff()
     
     from lib.block_updater import BlockUpdater
     from lib.template_registry import TemplateRegistry
@@ -105,12 +110,28 @@ def setup(on_startup):
     coinbaser = SimpleCoinbaser(bitcoin_rpc, getattr(settings, 'CENTRAL_WALLET'))
     (yield coinbaser.on_load)
     
+    on_template = MiningSubscription.on_template
+    partition_bits = 0
+    if settings.FRONTEND_PROCESSES:
+        # Multi-process mode, templates are pushed also to front-end processes
+        # and every process gets its own partition of extranonce1 space
+        from distributor import TemplateDistributor
+        from lib.extranonce_counter import get_partition_bits
+        distributor = TemplateDistributor(MiningSubscription.on_template)
+        on_template = distributor.on_template
+        Interfaces.worker_manager.on_invalidate = distributor.invalidate_worker
+        from service import admission
+        admission.on_ban_ip = distributor.ban_ip
+        admission.on_unban_ip = distributor.unban_ip
+        partition_bits = get_partition_bits(settings.FRONTEND_PROCESSES + 1)
+    
     registry = TemplateRegistry(BlockTemplate,
                                 coinbaser,
                                 bitcoin_rpc,
                                 getattr(settings, 'INSTANCE_ID'),
-                                MiningSubscription.on_template,
-                                Interfaces.share_manager.on_network_block)
+                                on_template,
+                                Interfaces.share_manager.on_network_block,
+                                0, partition_bits)
     
     # Template registry is the main interface between Stratum service
     # and pool core logic
@@ -120,10 +141,14 @@ def setup(on_startup):
     # This is just failsafe solution when -blocknotify
     # mechanism is not working properly    
     BlockUpdater()
-
-    prune_thr = threading.Thread(target=WorkLogPruner, args=(Interfaces.worker_manager.job_log,))
-    prune_thr.daemon = True
-    prune_thr.start()
+    
+    if settings.FRONTEND_PROCESSES:
+        from distributor import spawn_frontend
+        from frontend import listen_shared
+        distributor.listen(settings.FRONTEND_SOCKET)
+        for index in range(1, settings.FRONTEND_PROCESSES + 1):
+            spawn_frontend(index)
+        listen_shared(settings.LISTEN_SOCKET_TRANSPORT)
     
     log.info("MINING SERVICE IS READY")
 
@@ -0,0 +1,106 @@
+'''Early admission of submitted shares. All checks here are cheap
+and run before the worker is authorized and before any hashing,
+so misbehaving or broken rigs cost almost no CPU.'''
+
+import re
+
+import lib.settings as settings
+from lib.exceptions import SubmitException
+from interfaces import Interfaces
+
+import lib.logger
+log = lib.logger.get_logger('admission')
+
+is_hex = re.compile('^[0-9a-fA-F]*$').match
+
+class AdmissionControl(object):
+    '''Keeps ban table of workers and IP addresses
+    and limits submit rate of every connection.'''
+
+    def __init__(self):
+        # worker_name / ip -> timestamp when the ban expires
+        self.banned_workers = {}
+        self.banned_ips = {}
+        self.rejected = 0
+        # Called with the IP address (and duration of the ban) after IP ban
+        # changes, multi-process mode passes them to the other processes
+        self.on_ban_ip = None
+        self.on_unban_ip = None
+
+    def ban_worker(self, worker_name, duration):
+        self.banned_workers[worker_name] = Interfaces.timestamper.time() + duration
+
+    def ban_ip(self, ip, duration, propagate=True):
+        log.info("Banning IP %s for %d sec" % (ip, duration))
+        self.banned_ips[ip] = Interfaces.timestamper.time() + duration
+        if propagate and self.on_ban_ip != None:
+            self.on_ban_ip(ip, duration)
+
+    def unban_ip(self, ip, propagate=True):
+        if propagate and self.on_unban_ip != None:
+            self.on_unban_ip(ip)
+        return self.banned_ips.pop(ip, None) != None
+
+    def _is_banned(self, table, key, now):
+        expires = table.get(key)
+        if expires == None:
+            return False
+        if expires <= now:
+            del table[key]
+            return False
+        return True
+
+    def _take_token(self, session, now):
+        '''Token bucket of the connection, stored in its session'''
+        bucket = session.get('submit_bucket')
+        if bucket == None:
+            bucket = session['submit_bucket'] = [settings.SUBMIT_RATE_BURST, now]
+
+        tokens = min(settings.SUBMIT_RATE_BURST, bucket[0] + (now - bucket[1]) * settings.SUBMIT_RATE_LIMIT)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            return False
+        bucket[0] = tokens - 1
+        return True
+
+    def check_connection(self, session, ip):
+        '''Raises SubmitException when the connection should not submit
+        at all. These rejections aren't recorded by the share manager,
+        flooding client would flood the database otherwise.'''
+        now = Interfaces.timestamper.time()
+
+        if settings.SUBMIT_RATE_LIMIT and not self._take_token(session, now):
+            self.rejected += 1
+            raise SubmitException("Submit rate limit exceeded")
+
+        if self._is_banned(self.banned_ips, ip, now):
+            self.rejected += 1
+            raise SubmitException("IP address is temporarily banned")
+
+    def check_share(self, worker_name, extranonce2, ntime, nonce):
+        '''Raises SubmitException when the share of the worker should
+        be rejected without hashing. The ban table is the only place
+        where bans of workers are kept.'''
+        now = Interfaces.timestamper.time()
+
+        if self._is_banned(self.banned_workers, worker_name, now):
+            self.rejected += 1
+            raise SubmitException("Worker is temporarily banned")
+
+        extranonce2_size = Interfaces.template_registry.extranonce2_size
+        if len(extranonce2) != extranonce2_size * 2 or not is_hex(extranonce2):
+            self.rejected += 1
+            raise SubmitException("Incorrect size of extranonce2. Expected %d chars" % (extranonce2_size * 2))
+
+        if len(ntime) != 8 or not is_hex(ntime):
+            self.rejected += 1
+            raise SubmitException("Incorrect size of ntime. Expected 8 chars")
+
+        if len(nonce) != 8 or not is_hex(nonce):
+            self.rejected += 1
+            raise SubmitException("Incorrect size of nonce. Expected 8 chars")
+
+    def get_stats(self):
+        return {'banned_workers': len(self.banned_workers), 'banned_ips': len(self.banned_ips),
+                'rejected': self.rejected}
@@ -3,12 +3,9 @@ import lib.settings as settings
 import lib.logger
 log = lib.logger.get_logger('BasicShareLimiter')
 
-import DBInterface
-dbi = DBInterface.DBInterface()
-dbi.clear_worker_diff()
-
 from twisted.internet import defer
 from mining.interfaces import Interfaces
+from mining.write_batcher import outbox
 import time
 
 ''' This is just a customized ring buffer '''
@@ -89,7 +86,7 @@ class BasicShareLimiter(object):
         # Init the stats for this worker if it isn't set.        
         if worker_name not in self.worker_stats or self.worker_stats[worker_name]['last_ts'] < ts - settings.DB_USERCACHE_TIME :
             self.worker_stats[worker_name] = {'last_rtc': (ts - self.retarget / 2), 'last_ts': ts, 'buffer': SpeedBuffer(self.buffersize) }
-            dbi.update_worker_diff(worker_name, settings.POOL_TARGET)
+            Interfaces.worker_manager.update_difficulty(worker_name, settings.POOL_TARGET)
             return
         
         # Standard share update of data
@@ -168,14 +165,14 @@ class BasicShareLimiter(object):
         self.worker_stats[worker_name]['buffer'].clear()
         session = connection_ref().get_session()
 
-        (job_id, prevhash, coinb1, coinb2, merkle_branch, version, nbits, ntime, _) = \
-            Interfaces.template_registry.get_last_broadcast_args()
-        work_id = Interfaces.worker_manager.register_work(worker_name, job_id, new_diff)
+        template = Interfaces.template_registry.get_last_template()
+        Interfaces.worker_manager.set_difficulty(session, new_diff)
+        work_id = Interfaces.worker_manager.get_work_id(session, template.job_id)
         
-        session['difficulty'] = new_diff
-        connection_ref().rpc('mining.set_difficulty', [new_diff, ], is_notification=True)
+        # Both messages leave in one write
+        outbox.notify(connection_ref(), 'mining.set_difficulty', [new_diff, ])
         log.debug("Notified of New Difficulty")
-        connection_ref().rpc('mining.notify', [work_id, prevhash, coinb1, coinb2, merkle_branch, version, nbits, ntime, False, ], is_notification=True)
+        outbox.write(connection_ref(), template.notify_message(work_id, False))
         log.debug("Sent new work")
-        dbi.update_worker_diff(worker_name, new_diff)
+        Interfaces.worker_manager.update_difficulty(worker_name, new_diff)
 
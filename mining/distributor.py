@@ -0,0 +1,174 @@
+'''Master side of the multi-process mode.
+
+Master process runs TemplateRegistry, builds templates and pushes them
+to front-end processes over local UNIX socket. Front-ends handle Stratum
+connections and send shares back, so there's still a single DB writer.
+Front-ends are started by the master, see FRONTEND_PROCESSES.'''
+
+import os
+import sys
+import stat
+import simplejson as json
+from twisted.internet import reactor, protocol
+from twisted.protocols.basic import Int32StringReceiver
+
+import lib.settings as settings
+from interfaces import Interfaces
+from service import admission
+
+import lib.logger
+log = lib.logger.get_logger('distributor')
+
+class MessageProtocol(Int32StringReceiver):
+    '''JSON messages between master and front-ends. Message is a list
+    of plain values, the first one is the name of the message.'''
+
+    # Template with big mempool has several megabytes
+    MAX_LENGTH = 2 ** 28
+
+    def send(self, message):
+        self.sendString(json.dumps(message))
+
+    def stringReceived(self, data):
+        try:
+            message = json.loads(data)
+            self.factory.on_message(self, message[0], message[1:])
+        except Exception:
+            log.exception("Cannot process message %s" % data[:100])
+
+    def connectionMade(self):
+        self.factory.on_connect(self)
+
+    def connectionLost(self, reason):
+        self.factory.on_disconnect(self)
+
+class TemplateDistributor(protocol.ServerFactory):
+    '''Pushes new templates to connected front-ends and passes
+    shares from front-ends to the share manager of the master.'''
+
+    protocol = MessageProtocol
+
+    def __init__(self, on_template_callback):
+        self.on_template_callback = on_template_callback
+        self.frontends = set()
+
+    def listen(self, path):
+        '''Listen on UNIX socket in the directory accessible
+        only by the user running the pool'''
+        if not os.path.isabs(path):
+            raise Exception("FRONTEND_SOCKET must be an absolute path: %s" % path)
+
+        directory = os.path.dirname(path)
+        if not os.path.lexists(directory):
+            os.makedirs(directory, 0700)
+        st = os.lstat(directory)
+        if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 077:
+            raise Exception("Directory of FRONTEND_SOCKET must be owned by the pool user with mode 0700: %s" % directory)
+
+        if os.path.lexists(path):
+            os.unlink(path)
+        log.info("Template distributor listening on %s" % path)
+        return reactor.listenUNIX(path, self, mode=0600)
+
+    def on_template(self, is_new_block):
+        '''Used as on_template_callback of TemplateRegistry.
+        Template is encoded once for all front-ends.'''
+        template = Interfaces.template_registry.get_last_template()
+        data = json.dumps(('template', template.get_state()))
+        for frontend in self.frontends:
+            frontend.sendString(data)
+
+        # Connections of the master itself
+        self.on_template_callback(is_new_block)
+
+    def on_connect(self, frontend):
+        self.frontends.add(frontend)
+        frontend.send(('settings', {'COINDAEMON_Reward': settings.COINDAEMON_Reward,
+                                    'COINDAEMON_TX': settings.COINDAEMON_TX}))
+
+        template = Interfaces.template_registry.get_last_template()
+        if template != None:
+            frontend.send(('template', template.get_state()))
+
+    def on_disconnect(self, frontend):
+        self.frontends.discard(frontend)
+
+    def invalidate_worker(self, worker_name, origin=None):
+        '''Used as on_invalidate of the worker manager, passes
+        invalidation to all front-ends except the one it came from.'''
+        for frontend in self.frontends:
+            if frontend is not origin:
+                frontend.send(('invalidate_worker', worker_name))
+
+    def ban_ip(self, ip, duration, origin=None):
+        '''Used as on_ban_ip of the admission control, passes IP bans
+        to all front-ends except the one it came from.'''
+        for frontend in self.frontends:
+            if frontend is not origin:
+                frontend.send(('ban_ip', ip, duration))
+
+    def unban_ip(self, ip, origin=None):
+        for frontend in self.frontends:
+            if frontend is not origin:
+                frontend.send(('unban_ip', ip))
+
+    def on_message(self, frontend, name, args):
+        if name == 'hello':
+            log.info("Front-end %d connected" % args[0])
+        elif name == 'invalidate_worker':
+            Interfaces.worker_manager.invalidate(args[0], propagate=False)
+            self.invalidate_worker(args[0], frontend)
+        elif name == 'ban_ip':
+            admission.ban_ip(args[0], args[1], propagate=False)
+            self.ban_ip(args[0], args[1], frontend)
+        elif name == 'unban_ip':
+            admission.unban_ip(args[0], propagate=False)
+            self.unban_ip(args[0], frontend)
+        elif name == 'worker_diff':
+            Interfaces.worker_manager.update_difficulty(args[0], args[1])
+        elif name == 'update_block':
+            Interfaces.template_registry.update_block(new_block=args[0])
+        elif name == 'share':
+            Interfaces.share_manager.on_submit_share(*args)
+        elif name == 'block':
+            Interfaces.share_manager.on_submit_block(*args)
+        else:
+            log.error("Unknown message %s from front-end" % name)
+
+class FrontendProcess(protocol.ProcessProtocol):
+    '''Front-end process started by the master. It's restarted when it dies.'''
+
+    def __init__(self, index):
+        self.index = index
+
+    def processEnded(self, reason):
+        if reactor.running:
+            log.error("Front-end %d exited (%s), restarting" % (self.index, reason.value))
+            reactor.callLater(5, spawn_frontend, self.index)
+
+# Transport of the running process of every front-end index
+_frontends = {}
+
+def spawn_frontend(index):
+    '''Start front-end process with given index (extranonce partition).
+    Master runs under twistd, so sys.argv[0] is the twistd script.'''
+    args = [sys.executable, sys.argv[0], '-ny', 'frontend.tac', '--pidfile=frontend-%d.pid' % index, '-l', '-']
+    env = dict(os.environ)
+    env['STRATUM_FRONTEND_INDEX'] = str(index)
+
+    process = FrontendProcess(index)
+    transport = reactor.spawnProcess(process, sys.executable, args, env=env, path=os.getcwd(),
+                                     childFDs={0: 'w', 1: 1, 2: 2})
+    if not _frontends:
+        # Once, respawned front-ends just replace their transports
+        reactor.addSystemEventTrigger('before', 'shutdown', _stop_frontends)
+    _frontends[index] = transport
+    log.info("Started front-end %d (pid %d)" % (index, transport.pid))
+    return transport
+
+def _stop_frontends():
+    for transport in _frontends.values():
+        try:
+            transport.signalProcess('TERM')
+        except Exception:
+            pass
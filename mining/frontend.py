@@ -0,0 +1,215 @@
+'''Front-end side of the multi-process mode.
+
+Front-end process accepts Stratum connections on the port shared
+with the master and other front-ends (SO_REUSEPORT), validates shares
+against templates received from the master and passes shares back
+to the master's share manager. See also distributor.py and frontend.tac.'''
+
+import socket
+from collections import deque
+from twisted.internet import reactor, defer, protocol, tcp
+
+import lib.settings as settings
+from lib.template_registry import TemplateRegistry
+from lib.exceptions import SubmitException
+from lib.extranonce_counter import get_partition_bits
+from interfaces import Interfaces, WorkerManagerInterface, dbi
+from distributor import MessageProtocol
+from service import admission
+
+import lib.logger
+log = lib.logger.get_logger('frontend')
+
+class ReusePort(tcp.Port):
+    '''TCP port which can be bound by several processes at once,
+    the kernel balances new connections between them.'''
+
+    def createInternetSocket(self):
+        s = tcp.Port.createInternetSocket(self)
+        # Python 2 doesn't always know the constant, 15 is its value on Linux
+        s.setsockopt(socket.SOL_SOCKET, getattr(socket, 'SO_REUSEPORT', 15), 1)
+        return s
+
+def listen_shared(port):
+    '''Listen on Stratum port shared by all processes instead of
+    the listener of Stratum framework. Call before on_startup fires.'''
+    import stratum.settings
+    from stratum.socket_transport import SocketTransportFactory
+    from stratum.services import ServiceEventHandler
+
+    # Same arguments as the listener of Stratum framework (stratum/server.py)
+    signing_key = None
+    if stratum.settings.SIGNING_KEY:
+        try:
+            from stratum import signature
+            signing_key = signature.load_privkey_pem(stratum.settings.SIGNING_KEY)
+        except Exception:
+            log.warning("Loading of signing key '%s' failed, protocol messages cannot be signed." % \
+                        stratum.settings.SIGNING_KEY)
+
+    stratum.settings.LISTEN_SOCKET_TRANSPORT = None
+    factory = SocketTransportFactory(debug=stratum.settings.DEBUG,
+                                     signing_key=signing_key,
+                                     signing_id=stratum.settings.SIGNING_ID,
+                                     event_handler=ServiceEventHandler,
+                                     tcp_proxy_protocol_enable=stratum.settings.TCP_PROXY_PROTOCOL)
+    p = ReusePort(port, factory, reactor=reactor)
+    p.startListening()
+    return p
+
+class DistributorClient(protocol.ReconnectingClientFactory):
+    '''Connection of the front-end to the master process.
+    Messages sent while the master is not connected are queued.
+    New shares are rejected once max_pending messages wait. Messages over
+    twice that (eg. records of rejected shares) are dropped and counted.'''
+
+    protocol = MessageProtocol
+    maxDelay = 10
+    max_pending = 10000
+
+    def __init__(self, index, registry_ready):
+        self.index = index
+        self.registry_ready = registry_ready
+        self.connection = None
+        self.pending = deque()
+        self.dropped = 0
+
+    def is_full(self):
+        return self.connection == None and len(self.pending) >= self.max_pending
+
+    def send(self, message):
+        if self.connection != None:
+            self.connection.send(message)
+        elif len(self.pending) < 2 * self.max_pending:
+            self.pending.append(message)
+        else:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                log.error("Master process is not connected, %d messages dropped" % self.dropped)
+
+    def on_connect(self, connection):
+        log.info("Connected to the master process")
+        self.resetDelay()
+        self.connection = connection
+        connection.send(('hello', self.index))
+        while self.pending:
+            connection.send(self.pending.popleft())
+
+    def on_disconnect(self, connection):
+        log.error("Lost connection to the master process")
+        self.connection = None
+
+    def on_message(self, connection, name, args):
+        if name == 'settings':
+            for (key, value) in args[0].items():
+                if isinstance(value, unicode):
+                    value = str(value)
+                setattr(settings, str(key), value)
+        elif name == 'invalidate_worker':
+            Interfaces.worker_manager.invalidate(args[0], propagate=False)
+        elif name == 'ban_ip':
+            admission.ban_ip(args[0], args[1], propagate=False)
+        elif name == 'unban_ip':
+            admission.unban_ip(args[0], propagate=False)
+        elif name == 'template':
+            state = args[0]
+            registry = Interfaces.template_registry
+            template = registry.block_template_class(Interfaces.timestamper, None, str(state['job_id']))
+            template.fill_from_state(state)
+            registry.add_template(template, template.height)
+            if not self.registry_ready.called:
+                self.registry_ready.callback(True)
+        else:
+            log.error("Unknown message %s from the master" % name)
+
+class FrontendTemplateRegistry(TemplateRegistry):
+    '''Registry of templates built by the master process. Shares are
+    validated and blocks submitted here, only building of templates
+    is left to the master.'''
+
+    def __init__(self, block_template_class, bitcoin_rpc, instance_id, on_template_callback, on_block_callback,
+                 client, extranonce_partition, extranonce_partition_bits):
+        self.client = client
+        super(FrontendTemplateRegistry, self).__init__(block_template_class, None, bitcoin_rpc, instance_id,
+                                                       on_template_callback, on_block_callback,
+                                                       extranonce_partition, extranonce_partition_bits)
+
+    def submit_share(self, *args, **kwargs):
+        if self.client.is_full():
+            # Share couldn't be recorded by the master
+            raise SubmitException("Server is busy, try again later")
+        return super(FrontendTemplateRegistry, self).submit_share(*args, **kwargs)
+
+    def update_block(self, new_block=False):
+        '''Ask the master for new template, it's pushed
+        to all front-ends once it's ready.'''
+        if self.last_block != None:
+            # The first one is sent by the master on connect
+            self.client.send(('update_block', new_block))
+        return defer.succeed(None)
+
+class RemoteShareManager(object):
+    '''Share manager passing shares to the single DB writer in the master'''
+
+    def __init__(self):
+        self.client = None
+        self.block_height = 0
+
+    def on_network_block(self, prevhash, block_height):
+        self.block_height = block_height
+
+    def on_submit_share(self, *args):
+        self.client.send(('share',) + args)
+
+    def on_submit_block(self, on_submit, *args):
+        self.client.send(('block', on_submit) + args)
+
+class RemoteWorkerManager(WorkerManagerInterface):
+    '''Worker manager storing difficulties of workers by the master'''
+
+    def __init__(self):
+        super(RemoteWorkerManager, self).__init__()
+        self.client = None
+
+    def update_difficulty(self, worker_name, difficulty):
+        self.client.send(('worker_diff', worker_name, difficulty))
+
+@defer.inlineCallbacks
+def setup(on_startup, index):
+    '''Setup front-end process, it's similar to mining.setup
+    but templates come from the master.'''
+    from lib.bitcoin_rpc_manager import BitcoinRPCManager
+    from lib.block_template import BlockTemplate
+    from subscription import MiningSubscription
+
+    log.info("Starting front-end %d" % index)
+
+    # Used for submitting blocks found by this front-end
+    bitcoin_rpc = BitcoinRPCManager()
+
+    registry_ready = defer.Deferred()
+    client = DistributorClient(index, registry_ready)
+    Interfaces.share_manager.client = client
+    Interfaces.worker_manager.client = client
+    dbi.start_workers_preload()
+    Interfaces.worker_manager.on_invalidate = lambda worker_name: client.send(('invalidate_worker', worker_name))
+    admission.on_ban_ip = lambda ip, duration: client.send(('ban_ip', ip, duration))
+    admission.on_unban_ip = lambda ip: client.send(('unban_ip', ip))
+
+    registry = FrontendTemplateRegistry(BlockTemplate,
+                                        bitcoin_rpc,
+                                        getattr(settings, 'INSTANCE_ID'),
+                                        MiningSubscription.on_template,
+                                        Interfaces.share_manager.on_network_block,
+                                        client,
+                                        index,
+                                        get_partition_bits(settings.FRONTEND_PROCESSES + 1))
+    Interfaces.set_template_registry(registry)
+    reactor.connectUNIX(settings.FRONTEND_SOCKET, client)
+
+    (yield registry_ready)
+
+    listen_shared(settings.LISTEN_SOCKET_TRANSPORT)
+    log.info("FRONT-END %d IS READY" % index)
+
+    on_startup.callback(True)
@@ -13,20 +13,31 @@ log = lib.logger.get_logger('interfaces')
 
 import DBInterface
 dbi = DBInterface.DBInterface()
-dbi.init_main()
 
 class WorkerManagerInterface(object):
     def __init__(self):
         self.worker_log = {}
         self.worker_log.setdefault('authorized', {})
-        self.job_log = {}
-        self.job_log.setdefault('None', {})
+        # Called with worker name after invalidation, multi-process
+        # mode passes invalidations to the other processes this way
+        self.on_invalidate = None
         return
 
     def authorize(self, worker_name, worker_password):
         # Important NOTE: This is called on EVERY submitted share. So you'll need caching!!!
         return dbi.check_password(worker_name, worker_password)
 
+    def invalidate(self, worker_name=None, propagate=True):
+        '''Forget cached authorization of the worker (of all workers for None).
+        Call it when password of the worker is changed or worker is removed.'''
+        dbi.invalidate_worker(worker_name)
+        if propagate and self.on_invalidate != None:
+            self.on_invalidate(worker_name)
+
+    def update_difficulty(self, worker_name, difficulty):
+        '''Store difficulty of the worker set by vardiff'''
+        return dbi.update_worker_diff(worker_name, difficulty)
+
     @defer.inlineCallbacks
     def get_user_difficulty(self, worker_name):
         wd = yield dbi.get_user_nb(worker_name)
@@ -36,21 +47,42 @@ class WorkerManagerInterface(object):
                 #dbi.update_worker_diff(worker_name, wd[6])
         defer.returnValue((False, settings.POOL_TARGET))
 
-    def register_work(self, worker_name, job_id, difficulty):
-        now = Interfaces.timestamper.time()
-        work_id = WorkIdGenerator.get_new_id()
-        self.job_log.setdefault(worker_name, {})[work_id] = (job_id, difficulty, now)
-        return work_id
+    def set_difficulty(self, session, difficulty):
+        '''Changes difficulty of the connection. New difficulty gets next
+        slot, so shares of jobs sent before the change are still checked
+        against the difficulty they were issued with.'''
+        if 'difficulty_slot' in session and session['difficulty'] == difficulty:
+            return
+        slot = (session.get('difficulty_slot', -1) + 1) % WorkId.slots
+        session.setdefault('difficulties', {})[slot] = difficulty
+        session['difficulty_slot'] = slot
+        session['difficulty'] = difficulty
+
+    def get_work_id(self, session, job_id):
+        '''Returns work id of the job for given connection'''
+        return WorkId.encode(job_id, session.get('difficulty_slot', 0))
+
+    def parse_work_id(self, session, work_id):
+        '''Returns (job_id, difficulty) of the work id sent by the miner'''
+        (job_id, slot) = WorkId.decode(work_id)
+        difficulty = session.get('difficulties', {}).get(slot, session['difficulty'])
+        return (job_id, difficulty)
+
+class WorkId(object):
+    '''Work id is the job id followed by two hex digits of difficulty
+    slot of the connection, so nothing is stored per job and connection.'''
+    slots = 0x100
+
+    @classmethod
+    def encode(cls, job_id, slot):
+        return "%s%02x" % (job_id, slot)
 
-class WorkIdGenerator(object):
-    counter = 1000
-    
     @classmethod
-    def get_new_id(cls):
-        cls.counter += 1
-        if cls.counter % 0xffff == 0:
-            cls.counter = 1
-        return "%x" % cls.counter
+    def decode(cls, work_id):
+        try:
+            return (work_id[:-2], int(work_id[-2:], 16))
+        except (TypeError, ValueError):
+            return (None, None)
 
 class ShareLimiterInterface(object):
     '''Implement difficulty adjustments here'''
@@ -163,7 +195,6 @@ class Interfaces(object):
         from lib.coinbaser import SimpleCoinbaser
         from lib.bitcoin_rpc_manager import BitcoinRPCManager
         from lib.block_template import BlockTemplate
-        from subscription import MiningSubscription
         
         #(host, port, user, password) = args
         bitcoin_rpc = BitcoinRPCManager()
@@ -198,7 +229,7 @@ class Interfaces(object):
                                      coinbaser,
                                      bitcoin_rpc,
                                      31,
-                                     MiningSubscription.on_template,
+                                     cls.template_registry.on_template_callback,
                                      cls.share_manager.on_network_block,
                                      data)
         
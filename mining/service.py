@@ -6,10 +6,14 @@ from stratum.services import GenericService, admin
 from stratum.pubsub import Pubsub
 from interfaces import Interfaces
 from subscription import MiningSubscription
+from admission import AdmissionControl
+from write_batcher import outbox
 from lib.exceptions import SubmitException
 import json
 import lib.logger
 log = lib.logger.get_logger('mining')
+
+admission = AdmissionControl()
                 
 class MiningService(GenericService):
     '''This service provides public API for Stratum mining proxy
@@ -49,6 +53,33 @@ class MiningService(GenericService):
         log.debug("Server stats request: %s" % serialized)
         return '%s' % serialized
 
+    @admin
+    def get_verifier_stats(self):
+        '''Returns queue depth and counters of the share verifier'''
+        return Interfaces.template_registry.share_verifier.get_stats()
+
+    @admin
+    def get_template_stats(self):
+        '''Returns memory usage and other details of templates in the history'''
+        return Interfaces.template_registry.get_template_stats()
+
+    @admin
+    def ban_ip(self, ip, duration=None):
+        '''Reject all shares from given IP address'''
+        admission.ban_ip(ip, int(duration) if duration else settings.WORKER_BAN_TIME)
+        return True
+
+    @admin
+    def unban_ip(self, ip):
+        return admission.unban_ip(ip)
+
+    @admin
+    def invalidate_worker(self, worker_name=None):
+        '''Drop cached authorization of the worker, or of all workers
+        if no name is given. Use it after changing the password.'''
+        Interfaces.worker_manager.invalidate(worker_name)
+        return True
+
     @admin
     def update_block(self, *args):
         """Connect this RPC call to 'litecoind -blocknotify' for
@@ -64,7 +95,7 @@ class MiningService(GenericService):
         else:
             log.info("New block notification received with no coinname")
 
-        Interfaces.template_registry.update_block()
+        Interfaces.template_registry.update_block(new_block=True)
         return True
 
     @admin
@@ -107,10 +138,11 @@ class MiningService(GenericService):
             session['authorized'][worker_name] = worker_password
             is_ext_diff = False
             if settings.ALLOW_EXTERNAL_DIFFICULTY:
-                (is_ext_diff, session['difficulty']) = yield Interfaces.worker_manager.get_user_difficulty(worker_name)
-                self.connection_ref().rpc('mining.set_difficulty', [session['difficulty'], ], is_notification=True)
+                (is_ext_diff, difficulty) = yield Interfaces.worker_manager.get_user_difficulty(worker_name)
+                Interfaces.worker_manager.set_difficulty(session, difficulty)
+                outbox.notify(self.connection_ref(), 'mining.set_difficulty', [session['difficulty'], ])
             else:
-                session['difficulty'] = settings.POOL_TARGET
+                Interfaces.worker_manager.set_difficulty(session, settings.POOL_TARGET)
             # worker_log = (valid, invalid, is_banned, diff, is_ext_diff, timestamp)
             Interfaces.worker_manager.worker_log['authorized'][worker_name] = (0, 0, False, session['difficulty'], is_ext_diff, Interfaces.timestamper.time())            
             defer.returnValue(True)
@@ -133,7 +165,8 @@ class MiningService(GenericService):
         
         session = self.connection_ref().get_session()
         session['extranonce1'] = extranonce1
-        session['difficulty'] = settings.POOL_TARGET  # Following protocol specs, default diff is 1
+        # Following protocol specs, default diff is 1
+        Interfaces.worker_manager.set_difficulty(session, settings.POOL_TARGET)
         return Pubsub.subscribe(self.connection_ref(), MiningSubscription()) + (extranonce1_hex, extranonce2_size)
 
     @defer.inlineCallbacks
@@ -142,9 +175,21 @@ class MiningService(GenericService):
         
         session = self.connection_ref().get_session()
         session.setdefault('authorized', {})
+        ip = self.connection_ref()._get_ip()
+        
+        # Cheap checks first, banned or broken rigs
+        # shouldn't cost database lookups or hashing
+        admission.check_connection(session, ip)
+        try:
+            admission.check_share(worker_name, extranonce2, ntime, nonce)
+        except SubmitException as e:
+            # Record rejected share of the worker authorized on this connection
+            if worker_name in session['authorized']:
+                Interfaces.share_manager.on_submit_share(worker_name, False, False, session.get('difficulty', 0),
+                    Interfaces.timestamper.time(), False, ip, e[0], 0)
+            raise
         
         # Check if worker is authorized to submit shares
-        ip = self.connection_ref()._get_ip()
         authorized = yield Interfaces.worker_manager.authorize(worker_name, session['authorized'].get(worker_name))
         if not authorized:
             log.info("Worker is not authorized: IP %s", str(ip))
@@ -157,36 +202,29 @@ class MiningService(GenericService):
             log.info("Connection is not subscribed for mining: IP %s", str(ip))
             raise SubmitException("Connection is not subscribed for mining")
         
-        # Get current block job_id
-        difficulty = session['difficulty']
-        if worker_name in Interfaces.worker_manager.job_log and work_id in Interfaces.worker_manager.job_log[worker_name]:
-            (job_id, difficulty, job_ts) = Interfaces.worker_manager.job_log[worker_name][work_id]
-        else:
-            job_ts = Interfaces.timestamper.time()
-            Interfaces.worker_manager.job_log.setdefault(worker_name, {})[work_id] = (work_id, difficulty, job_ts)
-            job_id = work_id
-        #log.debug("worker_job_log: %s" % repr(Interfaces.worker_manager.job_log))
+        # Work id carries job_id and difficulty slot of the connection
+        (job_id, difficulty) = Interfaces.worker_manager.parse_work_id(session, work_id)
 
         submit_time = Interfaces.timestamper.time()
 
         (valid, invalid, is_banned, diff, is_ext_diff, last_ts) = Interfaces.worker_manager.worker_log['authorized'][worker_name]
         percent = float(float(invalid) / (float(valid) if valid else 1) * 100)
 
-        if is_banned and submit_time - last_ts > settings.WORKER_BAN_TIME:
-            if percent > settings.INVALID_SHARES_PERCENT:
-                log.debug("Worker invalid percent: %0.2f %s STILL BANNED!" % (percent, worker_name))
-            else: 
-                is_banned = False
-                log.debug("Clearing ban for worker: %s UNBANNED" % worker_name)
-            (valid, invalid, is_banned, last_ts) = (0, 0, is_banned, Interfaces.timestamper.time())
-
-        if submit_time - last_ts > settings.WORKER_CACHE_TIME and not is_banned:
+        # Ban is kept in the admission ban table, which rejects shares of the
+        # worker until it expires. is_banned in worker_log is informational only.
+        if submit_time - last_ts > settings.WORKER_CACHE_TIME:
             if percent > settings.INVALID_SHARES_PERCENT and settings.ENABLE_WORKER_BANNING:
-                is_banned = True
                 log.debug("Worker invalid percent: %0.2f %s BANNED!" % (percent, worker_name))
+                admission.ban_worker(worker_name, settings.WORKER_BAN_TIME)
+                if settings.WORKER_BAN_IP:
+                    admission.ban_ip(ip, settings.WORKER_BAN_TIME)
+                Interfaces.worker_manager.worker_log['authorized'][worker_name] = (0, 0, True, difficulty, is_ext_diff, submit_time)
+                Interfaces.share_manager.on_submit_share(worker_name, False, False, difficulty,
+                    submit_time, False, ip, "Worker is temporarily banned", 0)
+                raise SubmitException("Worker is temporarily banned")
             else:
                 log.debug("Clearing worker stats for: %s" % worker_name)
-            (valid, invalid, is_banned, last_ts) = (0, 0, is_banned, Interfaces.timestamper.time())
+            (valid, invalid, is_banned, last_ts) = (0, 0, False, submit_time)
 
         #log.debug("%s (%d, %d, %s, %s, %d) %0.2f%% work_id(%s) job_id(%s) diff(%f)" % (worker_name, valid, invalid, is_banned, is_ext_diff, last_ts, percent, work_id, job_id, difficulty))
         if not is_ext_diff:    
@@ -195,16 +233,13 @@ class MiningService(GenericService):
         # This checks if submitted share meet all requirements
         # and it is valid proof of work.
         try:
-            (block_header, block_hash, share_diff, on_submit) = Interfaces.template_registry.submit_share(job_id,
-                worker_name, session, extranonce1_bin, extranonce2, ntime, nonce, difficulty)
+            (block_header, block_hash, share_diff, on_submit) = (yield Interfaces.template_registry.submit_share(job_id,
+                worker_name, session, extranonce1_bin, extranonce2, ntime, nonce, difficulty))
         except SubmitException as e:
             # block_header and block_hash are None when submitted data are corrupted
             invalid += 1
             Interfaces.worker_manager.worker_log['authorized'][worker_name] = (valid, invalid, is_banned, difficulty, is_ext_diff, last_ts)
 
-            if is_banned:
-                raise SubmitException("Worker is temporarily banned")
- 
             Interfaces.share_manager.on_submit_share(worker_name, False, False, difficulty,
                 submit_time, False, ip, e[0], 0)   
             raise
@@ -212,9 +247,6 @@ class MiningService(GenericService):
         valid += 1
         Interfaces.worker_manager.worker_log['authorized'][worker_name] = (valid, invalid, is_banned, difficulty, is_ext_diff, last_ts)
 
-        if is_banned:
-            raise SubmitException("Worker is temporarily banned")
- 
         if on_submit != None:
             # found a block solution - add share to db table in callback
             # Pool performs submitblock() to litecoind. Let's hook
@@ -1,5 +1,7 @@
+from twisted.internet import task
 from stratum.pubsub import Pubsub, Subscription
 from mining.interfaces import Interfaces
+from mining.write_batcher import outbox
 
 import lib.settings as settings
 import lib.logger
@@ -10,56 +12,104 @@ class MiningSubscription(Subscription):
     logic for broadcasting new jobs to the clients."""
     event = 'mining.notify'
     
+    # CooperativeTask of the broadcast in progress
+    broadcast = None
+    broadcast_clean_jobs = False
+    
     @classmethod
     def on_template(cls, is_new_block):
         """This is called when TemplateRegistry registers
-           new block which we have to broadcast clients."""
+           new block which we have to broadcast clients.
+           Jobs are sent by chunks of BROADCAST_CHUNK_SIZE connections
+           across reactor iterations, so shares are processed meanwhile."""
         
-        start = Interfaces.timestamper.time()
         clean_jobs = is_new_block
         
-        (job_id, prevhash, coinb1, coinb2, merkle_branch, version, nbits, ntime, _) = \
-            Interfaces.template_registry.get_last_broadcast_args()
-
+        if cls.broadcast != None:
+            # Newer template supersedes the broadcast in progress. Clients which
+            # didn't get the new block yet still have to drop their jobs.
+            log.info("Aborting broadcast in progress")
+            clean_jobs = clean_jobs or cls.broadcast_clean_jobs
+            cls.broadcast.stop()
+        
+        # Message is JSON-encoded once, only job id is filled in for every connection
+        template = Interfaces.template_registry.get_last_template()
+        subscriptions = list(Pubsub.iterate_subscribers(cls.event))
+        
+        broadcast = task.cooperate(cls._broadcast(template, subscriptions, clean_jobs))
+        cls.broadcast = broadcast
+        cls.broadcast_clean_jobs = clean_jobs
+        
+        def _finished(result):
+            if cls.broadcast is broadcast:
+                cls.broadcast = None
+        
+        d = broadcast.whenDone()
+        d.addErrback(lambda failure: failure.trap(task.TaskStopped))
+        d.addBoth(_finished)
+    
+    @classmethod
+    def _broadcast(cls, template, subscriptions, clean_jobs):
+        """Generator sending job to the subscribers, it yields after every chunk.
+        Authorized miners are served first, the rest of connections after them."""
+        
+        start = Interfaces.timestamper.time()
+        job_id = template.job_id
+        chunk_size = settings.BROADCAST_CHUNK_SIZE or len(subscriptions) or 1
+        unauthorized = []
+        sent = 0
+        
         # Push new job to subscribed clients
-        for subscription in Pubsub.iterate_subscribers(cls.event):
+        for subscription in subscriptions:
             try:
                 if subscription != None:
-                    session = subscription.connection_ref().get_session()
+                    connection = subscription.connection_ref()
+                    if connection == None:
+                        continue
+                    session = connection.get_session()
                     session.setdefault('authorized', {})
                     if session['authorized'].keys():
-                        worker_name = session['authorized'].keys()[0]
-                        difficulty = session['difficulty']
-                        work_id = Interfaces.worker_manager.register_work(worker_name, job_id, difficulty)
+                        work_id = Interfaces.worker_manager.get_work_id(session, job_id)
                         #log.debug("emitting for work id %s job id %s block %s " % (work_id, job_id, prevhash))
-                        subscription.emit_single(work_id, prevhash, coinb1, coinb2, merkle_branch, version,
-                                                 nbits, ntime, clean_jobs)
+                        outbox.write(connection, template.notify_message(work_id, clean_jobs))
+                        sent += 1
+                        if sent % chunk_size == 0:
+                            yield None
                     else:
-                        subscription.emit_single(job_id, prevhash, coinb1, coinb2, merkle_branch, version,
-                                                 nbits, ntime, clean_jobs)
+                        unauthorized.append((connection, session))
             except Exception as e:
                 log.exception("Error broadcasting work to client %s" % str(e))
                 pass
         
-        cnt = Pubsub.get_subscription_count(cls.event)
-        log.info("BROADCASTED to %d connections in %.03f sec" % (cnt, (Interfaces.timestamper.time() - start)))
+        for (connection, session) in unauthorized:
+            try:
+                work_id = Interfaces.worker_manager.get_work_id(session, job_id)
+                outbox.write(connection, template.notify_message(work_id, clean_jobs))
+            except Exception as e:
+                log.exception("Error broadcasting work to client %s" % str(e))
+            sent += 1
+            if sent % chunk_size == 0:
+                yield None
+        
+        log.info("BROADCASTED to %d connections in %.03f sec" % (sent, (Interfaces.timestamper.time() - start)))
         
     def _finish_after_subscribe(self, result):
         """Send new job to newly subscribed client"""
         try:        
-            (job_id, prevhash, coinb1, coinb2, merkle_branch, version, nbits, ntime, _) = \
-                        Interfaces.template_registry.get_last_broadcast_args()
+            template = Interfaces.template_registry.get_last_template()
+            session = self.connection_ref().get_session()
+            work_id = Interfaces.worker_manager.get_work_id(session, template.job_id)
         except Exception:
             log.error("Template not ready yet")
             return result
         
         # Force set higher difficulty
-        self.connection_ref().rpc('mining.set_difficulty', [settings.POOL_TARGET, ], is_notification=True)
+        outbox.notify(self.connection_ref(), 'mining.set_difficulty', [settings.POOL_TARGET, ])
         # self.connection_ref().rpc('client.get_version', [])
         
         # Force client to remove previous jobs if any (eg. from previous connection)
         clean_jobs = True
-        self.emit_single(job_id, prevhash, coinb1, coinb2, merkle_branch, version, nbits, ntime, True)
+        outbox.write(self.connection_ref(), template.notify_message(work_id, clean_jobs))
         
         return result
                 
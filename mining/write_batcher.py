@@ -0,0 +1,61 @@
+'''Coalescing of outgoing messages. Messages queued for a connection
+during one reactor iteration are written together by single
+writeSequence, so set_difficulty and notify sent one after another
+leave in one TCP segment.'''
+
+import json
+from twisted.internet import reactor
+from stratum.protocol import Protocol
+
+import lib.logger
+log = lib.logger.get_logger('write_batcher')
+
+class WriteBatcher(object):
+    '''Queues wire messages per connection and flushes
+    all of them at the start of the next reactor iteration.'''
+
+    def __init__(self):
+        # connection -> list of messages in order of writing
+        self.pending = {}
+        self.delayed = None
+
+    def write(self, connection, data):
+        '''Queue already encoded message for the connection'''
+        messages = self.pending.get(connection)
+        if messages == None:
+            self.pending[connection] = [data, ]
+        else:
+            messages.append(data)
+
+        if self.delayed == None:
+            self.delayed = reactor.callLater(0, self.flush)
+
+    def notify(self, connection, method, params):
+        '''Queue JSON-RPC notification, it's encoded the same
+        way as notifications sent by connection.rpc()'''
+        self.write(connection, json.dumps({'id': None, 'method': method, 'params': params}) + "\n")
+
+    def flush(self):
+        self.delayed = None
+        (pending, self.pending) = (self.pending, {})
+
+        for (connection, messages) in pending.iteritems():
+            try:
+                if self._is_plain(connection):
+                    connection.transport.writeSequence(messages)
+                else:
+                    # Transports like websockets frame every message
+                    for data in messages:
+                        connection.transport_write(data)
+            except AttributeError:
+                # Transport is disconnected
+                pass
+            except Exception:
+                log.exception("Cannot write to connection")
+
+    def _is_plain(self, connection):
+        '''True if connection writes to socket as it is'''
+        method = getattr(type(connection), 'transport_write', None)
+        return getattr(method, 'im_func', None) is Protocol.transport_write.im_func
+
+outbox = WriteBatcher()